@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import asyncio
+import contextlib
+from collections import deque
+from ContextBuilder import estimateTokens
+
+class SSEDecoder():
+    """Incremental Server-Sent Events parser. feed() takes raw chunks (split anywhere) and returns the data of every event they completed."""
+
+    def __init__(self):
+        self.buffer = b""
+        self.data = []
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        events = []
+        while True:
+            end = self.buffer.find(b"\n")
+            if end < 0:
+                return events
+            line = self.buffer[:end].rstrip(b"\r").decode("utf-8")
+            self.buffer = self.buffer[end + 1:]
+            if not line:
+                if self.data:
+                    events.append("\n".join(self.data))
+                    self.data = []
+            elif line.startswith(":"):
+                continue # Comment, servers send these to keep the connection alive
+            elif line.startswith("data:"):
+                value = line[5:]
+                self.data.append(value[1:] if value.startswith(" ") else value)
+
+class NDJSONDecoder():
+    """Incremental newline delimited JSON parser. feed() takes raw chunks and returns every object they completed."""
+
+    def __init__(self):
+        self.buffer = b""
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split(b"\n")
+        return [json.loads(line) for line in lines if line.strip()]
+
+class HTTPBackend():
+    """Base for custom AI backends served over HTTP. Streams go over the app transport, so the connection to the
+    server stays open between replies. Same interface as LlamaWorker: stream(), countTokens(), close()."""
+    name = "HTTP"
+
+    def __init__(self, transport, model):
+        self.transport = transport
+        self.model = model
+        self.firstTokenLatencies = deque(maxlen=50) # Seconds from sending a request to its first token
+
+    def headers(self):
+        return {"Content-Type": "application/json"}
+
+    async def countTokens(self, texts):
+        return await estimateTokens(texts) # Neither API has a tokenizer endpoint everyone implements
+
+    def reportFirstToken(self, started):
+        latency = time.perf_counter() - started
+        self.firstTokenLatencies.append(latency)
+        print(f"{self.name} ({self.model}): first token after {latency:.2f}s")
+
+    async def post(self, url, payload, decoder):
+        """Posts payload and yields what the decoder makes of the response as it arrives."""
+        async with self.transport.session().post(url, json=payload, headers=self.headers()) as response:
+            if response.status != 200:
+                raise RuntimeError(f"{self.name} server answered {response.status}: {(await response.text())[:200]}")
+            async for chunk in response.content.iter_any():
+                for item in decoder.feed(chunk):
+                    yield item
+
+    async def warm(self):
+        """Opens the connection (and loads the model, where the server supports it) ahead of the first reply."""
+
+    async def close(self):
+        pass # The connections belong to the app transport
+
+class OpenAICompatBackend(HTTPBackend):
+    """OpenAI-compatible /v1/chat/completions with stream=True (Server-Sent Events)."""
+    name = "OpenAI-compatible"
+
+    def __init__(self, transport, base_url, api_key, model):
+        super().__init__(transport, model)
+        base_url = base_url.rstrip("/")
+        self.base_url = base_url if base_url.endswith("/v1") else base_url + "/v1"
+        self.api_key = api_key
+
+    def headers(self):
+        headers = super().headers()
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    async def stream(self, messages, state_key=None, prefix_key=None, **options):
+        payload = {"model": self.model, "messages": messages, "stream": True, **options}
+        started = time.perf_counter()
+        first = True
+        async with contextlib.aclosing(self.post(f"{self.base_url}/chat/completions", payload, SSEDecoder())) as events:
+            async for data in events:
+                if data == "[DONE]":
+                    return
+                chunk = json.loads(data)
+                if "error" in chunk:
+                    raise RuntimeError(f"{self.name} server error: {chunk['error']}")
+                if not chunk.get("choices"):
+                    continue
+                content = chunk["choices"][0].get("delta", {}).get("content")
+                if content:
+                    if first:
+                        self.reportFirstToken(started)
+                        first = False
+                    yield content
+
+    async def warm(self):
+        async with self.transport.session().get(f"{self.base_url}/models", headers=self.headers()) as response:
+            await response.read()
+
+class OllamaBackend(HTTPBackend):
+    """Ollama /api/chat (newline delimited JSON). Every request asks the server to keep the model loaded for keep_alive."""
+    name = "Ollama"
+
+    def __init__(self, transport, base_url, model, keep_alive="30m"):
+        super().__init__(transport, model)
+        self.base_url = base_url.rstrip("/")
+        # Ollama wants plain numbers (seconds, -1 for forever) as numbers, durations like "30m" as strings
+        self.keep_alive = int(keep_alive) if str(keep_alive).lstrip("-").isdigit() else keep_alive
+
+    async def stream(self, messages, state_key=None, prefix_key=None, **options):
+        payload = {"model": self.model, "messages": messages, "stream": True, "keep_alive": self.keep_alive}
+        if options:
+            payload["options"] = options
+        started = time.perf_counter()
+        first = True
+        async with contextlib.aclosing(self.post(f"{self.base_url}/api/chat", payload, NDJSONDecoder())) as chunks:
+            async for chunk in chunks:
+                if "error" in chunk:
+                    raise RuntimeError(f"{self.name} server error: {chunk['error']}")
+                content = chunk.get("message", {}).get("content")
+                if content:
+                    if first:
+                        self.reportFirstToken(started)
+                        first = False
+                    yield content
+                if chunk.get("done"):
+                    return
+
+    async def warm(self):
+        # A generate request without a prompt just loads the model
+        payload = {"model": self.model, "keep_alive": self.keep_alive}
+        async with self.transport.session().post(f"{self.base_url}/api/generate", json=payload) as response:
+            await response.read()
+
+def warmInBackground(backend):
+    async def warm():
+        try:
+            await backend.warm()
+        except Exception as e:
+            print(f"Couldn't warm up {backend.name} backend: {e}")
+    return asyncio.ensure_future(warm())
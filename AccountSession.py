@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from PySide6.QtCore import QObject, Signal
+
+class AccountSession(QObject):
+    """The logged in account (fetch_me), fetched once per login and shared by the UI and plugins.
+
+    account stays None until it has loaded. refresh() fetches it again in the background, refreshes asked for while
+    one is running share it, and changed is emitted once it's done (error holds what went wrong, if it failed).
+    A session without a client is a guest one, there's nothing to fetch."""
+    changed = Signal()
+
+    def __init__(self, client=None, token=None, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self.token = token
+        self.account = None
+        self.error = None
+        self.refreshing = None # Task running fetch_me
+
+    def isGuest(self):
+        return self.client is None
+
+    def username(self):
+        """What to call the user, None until the account has loaded."""
+        if self.isGuest():
+            return "Guest"
+        if self.account is None:
+            return None
+        return self.account.username or ("CharacterUser" + str(self.account.account_id))
+
+    def refresh(self):
+        if self.isGuest():
+            return None
+        if self.refreshing is None or self.refreshing.done():
+            self.refreshing = asyncio.ensure_future(self.fetch())
+            self.refreshing.add_done_callback(lambda task: task.cancelled() or task.exception()) # Reported in fetch
+        return self.refreshing
+
+    async def fetch(self):
+        try:
+            self.account = await self.client.account.fetch_me()
+            self.error = None
+        except Exception as e:
+            print(f"Failed to load account info: {e}")
+            self.error = e
+            raise
+        finally:
+            self.changed.emit()
+        return self.account
+
+    async def get(self):
+        """The account, fetched first if it hasn't been yet. None for guests."""
+        if self.account is None and not self.isGuest():
+            await asyncio.shield(self.refresh())
+        return self.account
+
+    def close(self):
+        if self.refreshing is not None:
+            self.refreshing.cancel()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import json
+import asyncio
+from urllib.parse import quote
+import libanoncai
+
+class PooledAnonClient(libanoncai.AsyncClient):
+    """libanoncai.AsyncClient opens a new aiohttp session per call. This does the same tRPC calls over the app transport."""
+
+    def __init__(self, transport, onCharacters=None):
+        super().__init__()
+        self.transport = transport
+        self.onCharacters = onCharacters # Called with the raw character dicts of every response (the app indexes them)
+
+    def seen(self, characters):
+        if self.onCharacters is not None and characters:
+            self.onCharacters(characters)
+        return characters
+
+    async def trpc(self, commands, payload):
+        url = f"https://character.ai/api/trpc/{commands}?batch={len(payload)}&input=" + quote(json.dumps(payload))
+        async with self.transport.session().get(url, headers=self.anoncaiheaders) as response:
+            return await response.json(content_type=None)
+
+    async def get_anonymous_search(self, searchQuery):
+        payload = {
+            "0": {
+                "json": {"searchQuery": searchQuery, "tagId": None, "sortedBy": None},
+                "meta": {"values": {"tagId": ["undefined"], "sortedBy": ["undefined"]}}
+            }
+        }
+        data = await self.trpc("search.search", payload)
+        chars = self.seen(data[0]["result"]["data"]["json"].get("characters", []))
+        return [libanoncai.PcharacterMedium(c) for c in chars]
+
+    async def get_anonymous_featured(self, category="Entertainment & Gaming"):
+        data = await self.trpc("discovery.charactersByCuratedAnon", {"0": {"json": {"category": category}}})
+        chars = self.seen(data[0]["result"]["data"]["json"].get("characters", []))
+        return [libanoncai.PcharacterMedium(c) for c in chars]
+
+    async def get_anonymous_chardef_raw(self, character_id):
+        # The character as the API sends it (what PcharacterMedium is built from), None if it can't be seen anonymously
+        data = await self.trpc("character.info", {"0": {"json": {"externalId": character_id}}})
+        res = data[0]["result"]["data"]["json"]
+        return self.seen([res["character"]])[0] if res["status"] == "OK" else None
+
+    async def get_anonymous_chardef(self, character_id):
+        character = await self.get_anonymous_chardef_raw(character_id)
+        return libanoncai.PcharacterMedium(character) if character is not None else None
+
+    async def multiget_anonymous_chardef(self, character_ids):
+        return [libanoncai.PcharacterMedium(c) for c in await self.multiget_anonymous_chardef_raw(character_ids)]
+
+    async def multiget_anonymous_chardef_raw(self, character_ids):
+        async def fetch_chunk(chunk):
+            payload = {str(i): {"json": {"externalId": cid}} for i, cid in enumerate(chunk)}
+            data = await self.trpc(",".join(["character.info"] * len(chunk)), payload)
+            return self.seen([r["result"]["data"]["json"]["character"]
+                    for r in data if r["result"]["data"]["json"]["status"] == "OK"])
+
+        chunk_size = 10
+        chunks = [character_ids[i:i + chunk_size] for i in range(0, len(character_ids), chunk_size)]
+        results = []
+        for chunk_result in await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks)):
+            results.extend(chunk_result)
+        return results
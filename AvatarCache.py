@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+import asyncio
+from collections import OrderedDict
+from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QLabel
+from ImagePipeline import ImagePipeline
+from NetStats import netstats, AVATARS
+
+FALLBACK_AVATAR_URL = "https://cdn3.emoji.gg/emojis/5708-rickroll-static.png" # We should stop rickrolling people with the fallback though, even if it is funny.
+
+class AvatarCache():
+    """Two tier avatar cache shared by every list in the app (and plugins).
+
+    Tier 1 is an in-memory LRU of decoded, already scaled pixmaps, limited by a byte budget.
+    Tier 2 is a content store on disk, keyed by URL + size + shape, holding the scaled image as PNG.
+    A hit in either tier costs no network I/O, and a memory hit costs no decode work either.
+    Decoding, scaling and masking happen on the image pipeline's workers, never on the GUI thread."""
+
+    def __init__(self, transport, cache_dir="cache/avatars", memory_budget=48 * 1024 * 1024, pipeline=None):
+        self.transport = transport
+        self.pipeline = pipeline or ImagePipeline()
+        self.cache_dir = cache_dir
+        self.memory_budget = memory_budget
+        self.memory = OrderedDict() # key -> QPixmap, oldest first
+        self.memory_bytes = 0
+        self.inflight = {} # key -> task loading it, so two rows asking for the same avatar only download it once
+        self.waiters = {} # task -> how many callers are waiting for it
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(url, size, rounded=False):
+        return (url or FALLBACK_AVATAR_URL, size, "round" if rounded else "fit")
+
+    def disk_path(self, key):
+        digest = hashlib.sha1("|".join(str(part) for part in key).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.png")
+
+    # Cache tiers
+
+    def get_cached(self, url, size, rounded=False):
+        """Returns the pixmap if it is in memory, or None. Never blocks."""
+        key = self.key(url, size, rounded)
+        pixmap = self.memory.get(key)
+        if pixmap is not None:
+            self.memory.move_to_end(key)
+            netstats.cacheHit(AVATARS)
+        return pixmap
+
+    @staticmethod
+    def cost(pixmap):
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def remember(self, key, pixmap):
+        cost = self.cost(pixmap)
+        if cost > self.memory_budget:
+            return # Would evict everything else for one giant image, not worth it.
+        old = self.memory.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= self.cost(old)
+        self.memory[key] = pixmap
+        self.memory_bytes += cost
+        while self.memory_bytes > self.memory_budget and self.memory:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= self.cost(evicted)
+
+    def clear_memory(self):
+        self.memory.clear()
+        self.memory_bytes = 0
+
+    # Loading
+
+    async def get(self, url, size, rounded=False):
+        """Returns a ready to display QPixmap for the avatar, or None if it couldn't be loaded.
+        Pass None as the url to get the fallback avatar."""
+        key = self.key(url, size, rounded)
+        pixmap = self.get_cached(url, size, rounded)
+        if pixmap is not None:
+            return pixmap
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.load(key))
+            self.inflight[key] = task
+            task.add_done_callback(lambda task: self.finished(key, task))
+        return await self.wait(key, task)
+
+    async def wait(self, key, task):
+        # One caller giving up (list closed, search replaced) doesn't cancel the load for the others, the last one does
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self.waiters[task] == 1:
+                task.cancel()
+                self.finished(key, task) # Whoever asks next starts a new load instead of joining this one
+            raise
+        finally:
+            self.waiters[task] -= 1
+            if not self.waiters[task]:
+                del self.waiters[task]
+
+    def finished(self, key, task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+
+    async def load(self, key):
+        url, size, shape = key
+        rounded = shape == "round"
+        pixmap = None
+        path = self.disk_path(key)
+        try:
+            if os.path.isfile(path):
+                pixmap = await self.pipeline.process(path=path)
+            if pixmap is not None:
+                netstats.cacheHit(AVATARS)
+            else:
+                async with self.transport.session().get(url) as response:
+                    response.raise_for_status()
+                    image_data = await response.read()
+                pixmap = await self.pipeline.process(image_data, size, rounded, save_to=path)
+            if pixmap is not None:
+                self.remember(key, pixmap)
+        except Exception as e:
+            print(f"Failed to load avatar {url}: {e}")
+        return pixmap
+
+    async def load_into(self, jobs, limit=6):
+        """Loads avatars into already inserted labels, at most limit downloads at a time.
+        jobs is a list of (url, size, QLabel). Labels get their pixmap as soon as it arrives, so rows fill in progressively."""
+        semaphore = asyncio.Semaphore(max(1, limit))
+        async def load_one(url, size, label):
+            async with semaphore:
+                pixmap = await self.get(url, size)
+            try:
+                if pixmap is not None:
+                    label.setPixmap(pixmap)
+                else:
+                    label.setText("X")
+            except RuntimeError:
+                pass # Row was removed (list cleared or view closed) before the avatar arrived
+        await asyncio.gather(*(load_one(url, size, label) for url, size, label in jobs))
+
+    @staticmethod
+    def placeholder(size):
+        """Fixed size label to insert in a row before its avatar is loaded, so the row doesn't resize when it arrives."""
+        label = QLabel("...")
+        label.setFixedSize(size, size)
+        label.setAlignment(Qt.AlignCenter)
+        return label
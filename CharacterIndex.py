@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import time
+import sqlite3
+
+class CharacterIndex():
+    """Local full-text index (SQLite FTS5) of every character the app has seen, from lists, searches and character info.
+
+    Records are the raw API dicts, merged per character (a search result doesn't wipe the description a chardef brought in).
+    search() ranks with bm25, name first, then title, author, description and greeting, so the search tab can show local
+    hits right away and still has something to show when the API is slow or rate limiting."""
+
+    # Column -> keys it may come from, the APIs don't agree on names
+    FIELDS = {
+        "name": ("participant__name", "name"),
+        "title": ("title",),
+        "author": ("user__username", "author_username"),
+        "description": ("description",),
+        "greeting": ("greeting",),
+    }
+    WEIGHTS = (10.0, 4.0, 3.0, 1.0, 0.5) # bm25 weight of each column above, in order
+
+    def __init__(self, path="cache/characters.sqlite3", limit=20000):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.limit = limit # Characters kept, the ones not seen for longest go first
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS characters (
+                id INTEGER PRIMARY KEY,
+                character_id TEXT NOT NULL UNIQUE,
+                raw TEXT NOT NULL,
+                seen REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS characters_by_seen ON characters (seen);
+            CREATE VIRTUAL TABLE IF NOT EXISTS character_text USING fts5(
+                {", ".join(self.FIELDS)}, tokenize = 'unicode61 remove_diacritics 2'
+            );
+        """)
+        self.db.commit()
+
+    @classmethod
+    def columns(cls, character):
+        values = []
+        for keys in cls.FIELDS.values():
+            values.append(next((str(character[key]) for key in keys if character.get(key)), ""))
+        return values
+
+    def add(self, characters):
+        """Indexes raw character dicts (anything with an external_id)."""
+        now = time.time()
+        added = False
+        with self.db:
+            for character in characters:
+                character_id = character.get("external_id") if isinstance(character, dict) else None
+                if not character_id:
+                    continue
+                row = self.db.execute("SELECT id, raw FROM characters WHERE character_id = ?", (character_id,)).fetchone()
+                if row is None:
+                    rowid = self.db.execute("INSERT INTO characters (character_id, raw, seen) VALUES (?, ?, ?)",
+                        (character_id, json.dumps(character), now)).lastrowid
+                    added = True
+                else:
+                    rowid, raw = row
+                    # Keep what the richer record had, but let anything present in the new one win
+                    character = {**json.loads(raw), **{key: value for key, value in character.items() if value not in (None, "")}}
+                    self.db.execute("UPDATE characters SET raw = ?, seen = ? WHERE id = ?", (json.dumps(character), now, rowid))
+                    self.db.execute("DELETE FROM character_text WHERE rowid = ?", (rowid,))
+                self.db.execute(f"INSERT INTO character_text (rowid, {', '.join(self.FIELDS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                    (rowid, *self.columns(character)))
+            if added:
+                self.prune()
+
+    def prune(self):
+        excess = self.db.execute("SELECT COUNT(*) FROM characters").fetchone()[0] - self.limit
+        if excess <= 0:
+            return
+        ids = self.db.execute("SELECT id FROM characters ORDER BY seen LIMIT ?", (excess,)).fetchall()
+        self.db.executemany("DELETE FROM character_text WHERE rowid = ?", ids)
+        self.db.executemany("DELETE FROM characters WHERE id = ?", ids)
+
+    @staticmethod
+    def matchQuery(query):
+        # Every word has to match, as a prefix, so results show up while the last word is still being typed
+        return " ".join(f'"{word}"*' for word in re.findall(r"\w+", query))
+
+    def search(self, query, limit=20):
+        """Raw dicts of the best matching characters, best first."""
+        match = self.matchQuery(query)
+        if not match:
+            return []
+        rows = self.db.execute(f"""
+            SELECT characters.raw FROM character_text JOIN characters ON characters.id = character_text.rowid
+            WHERE character_text MATCH ? ORDER BY bm25(character_text, {", ".join(map(str, self.WEIGHTS))}) LIMIT ?
+        """, (match, limit))
+        return [json.loads(raw) for (raw,) in rows]
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM characters").fetchone()[0]
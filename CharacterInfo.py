@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import hashlib
+import asyncio
+from collections import OrderedDict
+from NetStats import netstats
+
+def toCharacter(character):
+    from libanoncai import PcharacterMedium # Imported on first use, like everywhere else
+    return PcharacterMedium(character)
+
+class CharacterInfo():
+    """Character info (PcharacterMedium) shared by the whole app, fetched once.
+
+    Requests are coalesced: whoever asks for a character that is already being fetched waits for that fetch instead of
+    starting another. Results are kept for ttl seconds in memory (an LRU of the raw API dicts) and on disk (as JSON), so
+    opening a chat and then viewing its character, or reopening it after a restart, costs no round trip. If a refetch
+    fails, the expired copy is used. Characters that can't be seen anonymously are fetched with the logged in client.
+    getMany() loads whole lists in batched requests, prefetch() does so in the background."""
+
+    ENDPOINT = "tRPC character.info" # Where fetches would go, for netstats' cache hits
+
+    def __init__(self, anon, client, cache_dir="cache/characters", ttl=3600, memory_limit=1024, onFetched=None):
+        self.anon = anon # Callables returning the current anonymous and logged in clients, both are replaced on logout
+        self.client = client
+        self.onFetched = onFetched # Called with the raw dicts of characters fetched with the logged in client
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.memory_limit = memory_limit
+        self.memory = OrderedDict() # character id -> (fetched at, raw character), oldest first
+        self.inflight = {} # character id -> task fetching it
+        self.waiters = {} # task (fetch or batch) -> how many callers are waiting for it
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # Cache tiers
+
+    def disk_path(self, character_id):
+        return os.path.join(self.cache_dir, hashlib.sha1(character_id.encode("utf-8")).hexdigest() + ".json")
+
+    def remember(self, character_id, fetched, character):
+        self.memory[character_id] = (fetched, character)
+        self.memory.move_to_end(character_id)
+        while len(self.memory) > self.memory_limit:
+            self.memory.popitem(last=False)
+
+    def readDisk(self, character_id):
+        try:
+            with open(self.disk_path(character_id), "r", encoding="utf-8") as file:
+                entry = json.load(file)
+            return entry["fetched"], entry["character"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def writeDisk(self, character_id, fetched, character):
+        path = self.disk_path(character_id)
+        temp = path + ".tmp"
+        try:
+            with open(temp, "w", encoding="utf-8") as file:
+                json.dump({"fetched": fetched, "character": character}, file)
+            os.replace(temp, path)
+        except OSError as e:
+            print(f"Failed to cache character {character_id}: {e}")
+
+    async def cached(self, character_id, stale=False):
+        """The raw character if it's cached and fresh (or expired too, with stale), else None."""
+        entry = self.memory.get(character_id)
+        if entry is not None:
+            self.memory.move_to_end(character_id)
+        else:
+            entry = await asyncio.to_thread(self.readDisk, character_id)
+            if entry is None:
+                return None
+            self.remember(character_id, *entry)
+        fetched, character = entry
+        if stale or time.time() - fetched < self.ttl:
+            return character
+        return None
+
+    # Fetching
+
+    async def fetchLoggedIn(self, character_id):
+        character = (await self.client().character.fetch_character_info(character_id)).get_dict(raw=True)
+        if self.onFetched is not None:
+            self.onFetched([character])
+        return character
+
+    async def fetch(self, character_id):
+        character = await self.anon().get_anonymous_chardef_raw(character_id)
+        if character is None:
+            character = await self.fetchLoggedIn(character_id) # Not visible anonymously
+        return character
+
+    async def fetchBatch(self, character_ids):
+        return {character.get("external_id"): character for character in await self.anon().multiget_anonymous_chardef_raw(character_ids)}
+
+    async def fromBatch(self, batch, character_id):
+        character = (await asyncio.shield(batch)).get(character_id) # The batch is cancelled once every member task is
+        if character is None:
+            character = await self.fetchLoggedIn(character_id)
+        return character
+
+    async def store(self, character_id, load):
+        try:
+            character = await load
+        except Exception as e:
+            character = await self.cached(character_id, stale=True)
+            if character is None:
+                raise
+            print(f"Couldn't refresh character {character_id}, using the cached copy: {e}")
+            return character
+        fetched = time.time()
+        self.remember(character_id, fetched, character)
+        asyncio.ensure_future(asyncio.to_thread(self.writeDisk, character_id, fetched, character))
+        return character
+
+    def track(self, character_id, load, batch=None):
+        task = asyncio.ensure_future(self.store(character_id, load))
+        self.inflight[character_id] = task
+        if batch is not None:
+            self.join(batch) # Held by every member task until it's done
+        task.add_done_callback(lambda task: self.finished(character_id, task, load, batch))
+        return task
+
+    def finished(self, character_id, task, load, batch):
+        if self.inflight.get(character_id) is task:
+            del self.inflight[character_id]
+        if task.cancelled():
+            load.close() # Cancelled before store() started awaiting it
+        else:
+            task.exception() # Waiters get it, this only keeps asyncio from warning when nobody waited
+        if batch is not None:
+            self.leave(None, batch)
+
+    # One caller giving up doesn't cancel a fetch for the others, the last one does. Callers join a task as soon as they
+    # have it (before awaiting anything), so a fetch is never cancelled under someone about to wait for it.
+
+    def join(self, task):
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        return task
+
+    def leave(self, character_id, task):
+        self.waiters[task] -= 1
+        if self.waiters[task]:
+            return
+        del self.waiters[task]
+        if not task.done(): # Everyone gave up
+            task.cancel()
+            if self.inflight.get(character_id) is task:
+                del self.inflight[character_id] # Whoever asks next starts a new fetch instead of joining this one
+
+    async def wait(self, character_id, task):
+        self.join(task)
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self.leave(character_id, task)
+
+    async def get(self, character_id, fresh=False):
+        """The character as a PcharacterMedium. Raises if it can't be loaded. fresh skips the cache."""
+        if character_id not in self.inflight and not fresh:
+            character = await self.cached(character_id)
+            if character is not None:
+                netstats.cacheHit(self.ENDPOINT)
+                return toCharacter(character)
+        task = self.inflight.get(character_id) or self.track(character_id, self.fetch(character_id))
+        return toCharacter(await self.wait(character_id, task))
+
+    async def getMany(self, character_ids):
+        """The characters that could be loaded, in order. The ones not cached are fetched in batched requests."""
+        found = {}
+        waiting = {} # character id -> joined task
+        missing = []
+        try:
+            for character_id in dict.fromkeys(character_ids):
+                if character_id in self.inflight:
+                    waiting[character_id] = self.join(self.inflight[character_id])
+                    continue
+                character = await self.cached(character_id)
+                if character is not None:
+                    netstats.cacheHit(self.ENDPOINT)
+                    found[character_id] = character
+                else:
+                    missing.append(character_id)
+            for character_id in missing:
+                if character_id in self.inflight: # Started while we were reading the cache
+                    waiting[character_id] = self.join(self.inflight[character_id])
+            missing = [character_id for character_id in missing if character_id not in waiting]
+            if missing:
+                batch = asyncio.ensure_future(self.fetchBatch(missing))
+                for character_id in missing:
+                    waiting[character_id] = self.join(self.track(character_id, self.fromBatch(batch, character_id), batch))
+            results = await asyncio.gather(*(asyncio.shield(task) for task in waiting.values()), return_exceptions=True)
+        finally:
+            for character_id, task in waiting.items():
+                self.leave(character_id, task)
+        for character_id, result in zip(waiting, results):
+            if isinstance(result, Exception):
+                print(f"Failed to load character {character_id}: {result}")
+            else:
+                found[character_id] = result
+        return [toCharacter(found[character_id]) for character_id in character_ids if character_id in found]
+
+    def prefetch(self, character_ids):
+        """Loads characters in the background, so opening one of them later is instant."""
+        return asyncio.ensure_future(self.getMany(character_ids))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+class HistoryPager():
+    """Serves a chat's history a page at a time, newest page first, out of the local TranscriptStore.
+
+    Pages come from disk. Only when the stored run of turns is about to run out is the next server page
+    fetched (in the background, right after a page is handed out), so scrolling up usually finds it stored already."""
+
+    def __init__(self, client, store, chat_id, page_size=30):
+        self.client = client
+        self.store = store
+        self.chat_id = chat_id
+        self.page_size = max(1, page_size)
+        self.oldest = None # Oldest turn handed out so far
+        self.exhausted = False # True once neither the store nor the server has older turns
+        self.fetching = None # Task extending the store one server page further back
+
+    def hasMore(self):
+        return not self.exhausted
+
+    def storedPage(self):
+        return self.store.page(self.chat_id, self.page_size, before=self.oldest)
+
+    async def fetchOlder(self):
+        return await self.store.fetchOlder(self.client, self.chat_id)
+
+    def startFetch(self):
+        if self.fetching is None or self.fetching.done():
+            self.fetching = asyncio.ensure_future(self.fetchOlder())
+            self.fetching.add_done_callback(self.fetchDone)
+        return self.fetching
+
+    @staticmethod
+    def fetchDone(task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Failed to fetch chat history page: {task.exception()}")
+
+    def complete(self):
+        return self.store.chatState(self.chat_id)[1]
+
+    def prefetch(self):
+        if not self.complete() and len(self.store.page(self.chat_id, self.page_size, before=self.oldest)) < self.page_size:
+            self.startFetch()
+
+    def newestPage(self):
+        """The newest stored page, straight from disk (may be empty or stale, sync() brings it up to date)."""
+        page = self.store.page(self.chat_id, self.page_size)
+        if page:
+            self.oldest = page[0]
+        return page
+
+    async def sync(self):
+        """Brings the store up to date with the server. Returns (new turns newer than what was handed out, rewritten).
+        If rewritten is True turns that were handed out changed, and the shown transcript should be reloaded with reload()."""
+        newest_before = self.store.page(self.chat_id, 1)
+        rewritten = await self.store.sync(self.client, self.chat_id)
+        if rewritten or not newest_before:
+            return [], True
+        newer = []
+        for turn in reversed(self.store.page(self.chat_id, self.page_size * 4)):
+            if turn.turn_id == newest_before[0].turn_id:
+                break
+            newer.append(turn)
+        else:
+            return [], True # More new turns than we'd want to append one by one
+        return list(reversed(newer)), False
+
+    def reload(self, count):
+        """Restarts paging from the newest turn, returning at least the count newest turns (oldest first)."""
+        self.oldest = None
+        self.exhausted = False
+        page = self.store.page(self.chat_id, max(count, self.page_size))
+        if page:
+            self.oldest = page[0]
+        return page
+
+    async def nextPage(self):
+        """Returns the next (older) page of turns, oldest first, ready to be put above what is already shown. [] when there is nothing left."""
+        page = self.storedPage()
+        while len(page) < self.page_size and not self.complete():
+            if not await asyncio.shield(self.startFetch()):
+                break
+            page = self.storedPage()
+        if not page:
+            self.exhausted = True
+            return []
+        self.oldest = page[0]
+        self.prefetch()
+        return page
+
+    def cancel(self):
+        if self.fetching is not None and not self.fetching.done():
+            self.fetching.cancel()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime
+from PySide6.QtCore import Qt, QObject, QAbstractListModel, QModelIndex, QSize, QPoint, Signal, QTimer
+from PySide6.QtGui import QFontMetrics
+from PySide6.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView, QStyle, QMenu, QApplication
+
+def createdText(create_time, now=None):
+    if not isinstance(create_time, datetime.datetime):
+        return "Created: unknown"
+    if create_time.tzinfo is not None:
+        create_time = create_time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) # create_time is UTC
+    days = (now - create_time).days
+    if days <= 0:
+        return "Created: Today"
+    if days == 1:
+        return "Created: Yesterday"
+    return f"Created: {days} days ago"
+
+class ChatRow():
+    """One chat of the list. preview stays None until the last message has been loaded."""
+    __slots__ = ("chat_id", "create_time", "created", "preview")
+
+    def __init__(self, chat_id, create_time):
+        self.chat_id = chat_id
+        self.create_time = create_time
+        self.created = createdText(create_time)
+        self.preview = None
+
+class ChatListModel(QAbstractListModel):
+    """A character's chats, newest first."""
+    ChatIdRole = Qt.UserRole + 1
+    PreviewRole = Qt.UserRole + 2
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.chats = []
+        self.rows = {} # chat id -> row
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.chats)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.chats):
+            return None
+        chat = self.chats[index.row()]
+        if role == Qt.DisplayRole:
+            return chat.created
+        if role == self.ChatIdRole:
+            return chat.chat_id
+        if role == self.PreviewRole:
+            return chat.preview
+        return None
+
+    def setChats(self, chats):
+        """Takes PyCharacterAI Chats (anything with chat_id and create_time)."""
+        def newest(chat):
+            return chat.create_time.timestamp() if isinstance(chat.create_time, datetime.datetime) else 0
+        self.beginResetModel()
+        self.chats = [ChatRow(chat.chat_id, chat.create_time) for chat in sorted(chats, key=newest, reverse=True)]
+        self.rows = {chat.chat_id: row for row, chat in enumerate(self.chats)}
+        self.endResetModel()
+
+    def setPreview(self, chat_id, preview):
+        row = self.rows.get(chat_id)
+        if row is None or self.chats[row].preview == preview:
+            return
+        self.chats[row].preview = preview
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [self.PreviewRole])
+
+    def hasPreview(self, row):
+        return self.chats[row].preview is not None
+
+class ChatRowDelegate(QStyledItemDelegate):
+    """Two lines of plain text per chat: when it was created, and the last message (elided to one line).
+    Every row is the same height, so the view never has to measure rows it doesn't show."""
+    PADDING = 8
+
+    def sizeHint(self, option, index):
+        return QSize(0, 2 * QFontMetrics(option.font).lineSpacing() + 2 * self.PADDING)
+
+    def paint(self, painter, option, index):
+        self.initStyleOption(option, index)
+        option.text = ""
+        style = option.widget.style() if option.widget else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, option, painter, option.widget) # Background, hover and selection, themed
+        metrics = QFontMetrics(option.font)
+        rect = option.rect.adjusted(self.PADDING, self.PADDING, -self.PADDING, -self.PADDING)
+        selected = bool(option.state & QStyle.State_Selected)
+        palette = option.palette
+        painter.save()
+        painter.setFont(option.font)
+        painter.setPen(palette.highlightedText().color() if selected else palette.text().color())
+        painter.drawText(rect.x(), rect.y() + metrics.ascent(), index.data(Qt.DisplayRole))
+        preview = index.data(ChatListModel.PreviewRole)
+        if preview is None:
+            preview = "Loading last message..."
+        elif not preview:
+            preview = "(No messages)"
+        painter.setPen(palette.highlightedText().color() if selected else palette.placeholderText().color())
+        preview = metrics.elidedText(" ".join(preview.split()), Qt.ElideRight, rect.width())
+        painter.drawText(rect.x(), rect.y() + metrics.lineSpacing() + metrics.ascent(), preview)
+        painter.restore()
+
+class ChatListView(QListView):
+    """Virtualized list of a character's chats (see ChatListModel).
+    previewsWanted is emitted with the ids of the chats on screen that have no preview yet, once scrolling settles,
+    each chat only once. openChat is emitted on double click, Enter or the context menu."""
+    previewsWanted = Signal(list)
+    openChat = Signal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setObjectName("chat_list")
+        self.chats = ChatListModel(self)
+        self.setModel(self.chats)
+        self.setItemDelegate(ChatRowDelegate(self))
+        self.setUniformItemSizes(True)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.customContextMenuRequested.connect(self.showContextMenu)
+        self.activated.connect(self.open)
+        self.asked = set() # Chat ids previewsWanted was emitted for
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(100)
+        self.timer.timeout.connect(self.checkVisible)
+        self.verticalScrollBar().valueChanged.connect(lambda value: self.timer.start())
+        self.chats.modelReset.connect(self.timer.start)
+
+    def setChats(self, chats):
+        self.asked.clear()
+        self.chats.setChats(chats)
+
+    def open(self, index):
+        if index.isValid():
+            self.openChat.emit(index.data(ChatListModel.ChatIdRole))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.timer.start()
+
+    def visibleRows(self):
+        top = self.indexAt(QPoint(1, 1)).row()
+        if top < 0:
+            return range(0)
+        bottom = self.indexAt(QPoint(1, self.viewport().height() - 2)).row()
+        return range(top, (bottom if bottom >= 0 else self.chats.rowCount() - 1) + 1)
+
+    def checkVisible(self):
+        wanted = []
+        for row in self.visibleRows():
+            chat_id = self.chats.chats[row].chat_id
+            if not self.chats.hasPreview(row) and chat_id not in self.asked:
+                self.asked.add(chat_id)
+                wanted.append(chat_id)
+        if wanted:
+            self.previewsWanted.emit(wanted)
+
+    def showContextMenu(self, pos):
+        index = self.indexAt(pos)
+        if not index.isValid():
+            return
+        menu = QMenu(self)
+        open_action = menu.addAction("Open Chat")
+        if menu.exec(self.viewport().mapToGlobal(pos)) == open_action:
+            self.open(index)
+
+def previewText(turn):
+    return f"{turn.author_name}: {turn.text}" if turn.author_name else turn.text
+
+class ChatPreviewLoader(QObject):
+    """Fills in the last message of the chats a ChatListView asks for. What the transcript store already has is shown
+    right away, then the newest page of the chat is synced into the store (so opening the chat afterwards is instant)
+    and the preview updated from it. At most concurrency chats are synced at once."""
+
+    def __init__(self, client, store, model, concurrency=4):
+        super().__init__(model)
+        self.client = client
+        self.store = store
+        self.model = model
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks = set()
+
+    def load(self, chat_ids):
+        for chat_id in chat_ids:
+            stored = self.store.page(chat_id, 1)
+            if stored:
+                self.model.setPreview(chat_id, previewText(stored[0]))
+            task = asyncio.ensure_future(self.refresh(chat_id))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def refresh(self, chat_id):
+        async with self.semaphore:
+            try:
+                await self.store.sync(self.client, chat_id)
+            except Exception as e:
+                print(f"Failed to load the last message of chat {chat_id}: {e}")
+        newest = self.store.page(chat_id, 1)
+        if newest:
+            self.model.setPreview(chat_id, previewText(newest[0]))
+        elif self.model.chats[self.model.rows[chat_id]].preview is None:
+            self.model.setPreview(chat_id, "")
+
+    def cancel(self):
+        for task in list(self.tasks):
+            task.cancel()
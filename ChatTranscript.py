@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QPersistentModelIndex, QSize, QRectF, QPoint, Signal, QTimer
+from PySide6.QtGui import QTextDocument, QTextOption, QColor, QPainter, QAbstractTextDocumentLayout, QFontMetrics
+from PySide6.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView, QMenu, QApplication
+
+class TranscriptMessage():
+    """One rendered turn. version goes up every time the text changes, so cached layouts know they're stale."""
+    __slots__ = ("text", "is_human", "turn_id", "candidate_id", "version", "height_cache", "streaming")
+
+    def __init__(self, text, is_human, turn_id=None, candidate_id=None):
+        self.text = text
+        self.is_human = is_human
+        self.turn_id = turn_id
+        self.candidate_id = candidate_id
+        self.version = 0
+        self.height_cache = None # (width, version, height)
+        self.streaming = False # While True, only the last paragraph gets re-parsed on updates (see MessageDelegate.streamDocuments)
+
+    @classmethod
+    def fromTurn(cls, turn, candidate):
+        return cls(candidate.text, turn.author_is_human, turn.turn_id, candidate.candidate_id)
+
+class TranscriptModel(QAbstractListModel):
+    """Chat transcript as a plain list model. Oldest message is row 0."""
+    MessageRole = Qt.UserRole + 1
+    IsHumanRole = Qt.UserRole + 2
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.messages = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.messages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.messages):
+            return None
+        message = self.messages[index.row()]
+        if role == Qt.DisplayRole:
+            return message.text
+        if role == self.MessageRole:
+            return message
+        if role == self.IsHumanRole:
+            return message.is_human
+        return None
+
+    def appendMessage(self, message):
+        row = len(self.messages)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.messages.append(message)
+        self.endInsertRows()
+        return row
+
+    def appendMessages(self, messages):
+        if not messages:
+            return
+        first = len(self.messages)
+        self.beginInsertRows(QModelIndex(), first, first + len(messages) - 1)
+        self.messages.extend(messages)
+        self.endInsertRows()
+
+    def prependMessages(self, messages):
+        if not messages:
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(messages) - 1)
+        self.messages[0:0] = messages
+        self.endInsertRows()
+
+    def setMessages(self, messages):
+        self.beginResetModel()
+        self.messages = list(messages)
+        self.endResetModel()
+
+    def setMessageText(self, row, text):
+        """Changes the text of one row. Only that row is invalidated (this is what streaming uses on the last row)."""
+        message = self.messages[row]
+        if message.text == text:
+            return
+        message.text = text
+        message.version += 1
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def setStreaming(self, row, streaming):
+        """Switching streaming off re-renders the whole message once, as one document."""
+        message = self.messages[row]
+        message.streaming = streaming
+        message.version += 1
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+class MessageDelegate(QStyledItemDelegate):
+    """Paints chat bubbles straight from markdown, without a widget per message.
+
+    Heights are cached on the message per (width, version), and the laid out QTextDocuments are kept in a small LRU,
+    so only the messages that are actually on screen ever get (re)laid out and painted."""
+    USER_COLOR = QColor("#2F4F4F")
+    BOT_COLOR = QColor("#696969")
+    PADDING = 8
+    RADIUS = 10
+    NEAR_MARGIN = 20 # Margin on the side the bubble hugs
+    FAR_MARGIN = 50 # Margin on the other side
+    VERTICAL_MARGIN = 4
+
+    def __init__(self, overrideStyling, parent, cacheSize=128):
+        super().__init__(parent)
+        self.overrideStyling = overrideStyling
+        self.cacheSize = cacheSize
+        self.documents = OrderedDict() # (message, version, width) -> QTextDocument
+        self.streams = {} # message -> StreamLayout, only for messages that are streaming
+
+    def bubbleRect(self, message, rect):
+        left, right = (self.FAR_MARGIN, self.NEAR_MARGIN) if message.is_human else (self.NEAR_MARGIN, self.FAR_MARGIN)
+        return rect.adjusted(left, self.VERTICAL_MARGIN, -right, -self.VERTICAL_MARGIN)
+
+    def textWidth(self, viewWidth):
+        return max(50, viewWidth - self.NEAR_MARGIN - self.FAR_MARGIN - 2 * self.PADDING)
+
+    def document(self, message, width, font):
+        key = (message, message.version, width)
+        document = self.documents.get(key)
+        if document is not None:
+            self.documents.move_to_end(key)
+            return document
+        document = self.newDocument(message.text, message.is_human, width, font)
+        self.documents[key] = document
+        while len(self.documents) > self.cacheSize:
+            self.documents.popitem(last=False)
+        return document
+
+    @staticmethod
+    def newDocument(text, is_human, width, font):
+        document = QTextDocument()
+        document.setDefaultFont(font)
+        option = QTextOption()
+        option.setWrapMode(QTextOption.WrapAtWordBoundaryOrAnywhere)
+        option.setAlignment(Qt.AlignRight if is_human else Qt.AlignLeft)
+        document.setDefaultTextOption(option)
+        document.setDocumentMargin(0)
+        document.setMarkdown(text)
+        document.setTextWidth(width)
+        return document
+
+    def streamDocuments(self, message, width, font):
+        """Documents for a message that is still streaming: everything up to the last finished paragraph (parsed only when
+        a paragraph is finished), and the unfinished tail paragraph (parsed on every update)."""
+        stream = self.streams.get(message)
+        if stream is None or stream.width != width:
+            stream = self.streams[message] = StreamLayout(width)
+        head, tail = splitTailParagraph(message.text)
+        if head != stream.headText:
+            stream.headText = head
+            stream.head = self.newDocument(head, message.is_human, width, font) if head else None
+        if tail != stream.tailText or stream.tail is None:
+            stream.tailText = tail
+            stream.tail = self.newDocument(tail, message.is_human, width, font)
+        stream.gap = QFontMetrics(font).height() // 2 if stream.head is not None else 0
+        return stream
+
+    def textHeight(self, message, width, font):
+        if message.streaming:
+            stream = self.streamDocuments(message, width, font)
+            head = stream.head.size().height() if stream.head is not None else 0
+            return int(head + stream.gap + stream.tail.size().height())
+        self.streams.pop(message, None)
+        return int(self.document(message, width, font).size().height())
+
+    def viewWidth(self):
+        # option.rect isn't the row's width when measuring, so ask the view
+        return self.parent().viewport().width()
+
+    def sizeHint(self, option, index):
+        message = index.data(TranscriptModel.MessageRole)
+        viewWidth = self.viewWidth()
+        width = self.textWidth(viewWidth)
+        cached = message.height_cache
+        if cached is not None and cached[0] == width and cached[1] == message.version:
+            height = cached[2]
+        else:
+            height = self.textHeight(message, width, option.font)
+            message.height_cache = (width, message.version, height)
+        return QSize(viewWidth, height + 2 * (self.PADDING + self.VERTICAL_MARGIN))
+
+    def paint(self, painter, option, index):
+        message = index.data(TranscriptModel.MessageRole)
+        width = self.textWidth(self.viewWidth())
+        bubble = self.bubbleRect(message, option.rect)
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        if not self.overrideStyling:
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(self.USER_COLOR if message.is_human else self.BOT_COLOR)
+            painter.drawRoundedRect(QRectF(bubble), self.RADIUS, self.RADIUS)
+        painter.translate(bubble.left() + self.PADDING, bubble.top() + self.PADDING)
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.palette.setColor(context.palette.ColorRole.Text, option.palette.color(option.palette.ColorRole.Text))
+        context.clip = QRectF(0, 0, width, bubble.height() - 2 * self.PADDING)
+        if message.streaming:
+            stream = self.streamDocuments(message, width, option.font)
+            if stream.head is not None:
+                stream.head.documentLayout().draw(painter, context)
+                shift = stream.head.size().height() + stream.gap
+                painter.translate(0, shift)
+                context.clip = context.clip.translated(0, -shift)
+            stream.tail.documentLayout().draw(painter, context)
+        else:
+            self.document(message, width, option.font).documentLayout().draw(painter, context)
+        painter.restore()
+
+def splitTailParagraph(text):
+    """Splits markdown into (finished paragraphs, last paragraph). Never splits inside an open ``` code block."""
+    cut = text.rfind("\n\n")
+    while cut > 0 and text.count("```", 0, cut) % 2 == 1:
+        cut = text.rfind("\n\n", 0, text.rfind("```", 0, cut))
+    if cut <= 0:
+        return "", text
+    return text[:cut], text[cut + 2:]
+
+class StreamLayout():
+    __slots__ = ("width", "headText", "head", "tailText", "tail", "gap")
+
+    def __init__(self, width):
+        self.width = width
+        self.headText = ""
+        self.head = None
+        self.tailText = None
+        self.tail = None
+        self.gap = 0
+
+class StreamRenderer():
+    """Renders a streamed reply into one transcript row at a fixed frame budget.
+
+    Chunks only append their delta to a buffer, and the row is updated at most fps times per second,
+    with just the tail paragraph re-parsed each frame. finish() does one final full render.
+    The row is tracked with a persistent index, so older messages prepended while streaming don't move the target."""
+
+    def __init__(self, view, row, fps=30):
+        self.view = view
+        self.target = QPersistentModelIndex(view.transcript.index(row))
+        self.text = ""
+        self.dirty = False
+        self.interval = 1.0 / max(1, fps)
+        self.finished = False
+        self.timer = QTimer()
+        self.timer.setInterval(int(self.interval * 1000))
+        self.timer.timeout.connect(self.flush)
+        self.view.transcript.setStreaming(self.row, True)
+
+    @property
+    def row(self):
+        return self.target.row() # -1 once the row is gone (transcript reloaded)
+
+    def setText(self, text):
+        """For streams that send the whole text so far every time (c.ai). Appends the delta when possible."""
+        if text.startswith(self.text):
+            self.append(text[len(self.text):])
+        else:
+            self.text = text
+            self.markDirty()
+
+    def append(self, delta):
+        if delta:
+            self.text += delta
+            self.markDirty()
+
+    def markDirty(self):
+        self.dirty = True
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        if self.dirty:
+            self.dirty = False
+            if self.row >= 0:
+                self.view.transcript.setMessageText(self.row, self.text)
+        else:
+            self.timer.stop() # Nothing new this frame, sleep until the next chunk
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.timer.stop()
+        self.dirty = False
+        if self.row >= 0:
+            self.view.transcript.setMessageText(self.row, self.text)
+            self.view.transcript.setStreaming(self.row, False)
+
+class TranscriptView(QListView):
+    """Virtualized list of chat messages (see MessageDelegate).
+    nearTop is emitted when the user scrolls close to the oldest shown message, so older history can be loaded."""
+    nearTop = Signal()
+
+    def __init__(self, overrideStyling=False, parent=None):
+        super().__init__(parent)
+        self.setObjectName("chat_transcript")
+        self.transcript = TranscriptModel(self)
+        self.delegate = MessageDelegate(overrideStyling, self)
+        self.setModel(self.transcript)
+        self.setItemDelegate(self.delegate)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setResizeMode(QListView.Adjust)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setUniformItemSizes(False)
+        self.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.customContextMenuRequested.connect(self.showContextMenu)
+        # A changed row may have a new height
+        self.transcript.dataChanged.connect(self.rowsChanged)
+        # Streamed replies grow, so keep following the bottom until the user scrolls up
+        self.followBottom = False
+        self.verticalScrollBar().rangeChanged.connect(self.rangeChanged)
+        self.verticalScrollBar().valueChanged.connect(self.scrolled)
+
+    def scrollToBottom(self):
+        self.followBottom = True
+        super().scrollToBottom()
+
+    def rangeChanged(self, minimum, maximum):
+        if self.followBottom:
+            self.verticalScrollBar().setValue(maximum)
+
+    def scrolled(self, value):
+        self.followBottom = value >= self.verticalScrollBar().maximum()
+        if value < 2 * self.viewport().height():
+            self.nearTop.emit()
+
+    def isScrollable(self):
+        return self.verticalScrollBar().maximum() > 0
+
+    def prependMessages(self, messages):
+        """Puts older messages above the current ones without moving what the user is looking at."""
+        anchor = self.indexAt(QPoint(0, 0))
+        anchorRow = anchor.row() if anchor.isValid() else None
+        offset = self.visualRect(anchor).top() if anchor.isValid() else 0
+        self.transcript.prependMessages(messages)
+        self.executeDelayedItemsLayout()
+        if anchorRow is not None:
+            moved = self.visualRect(self.transcript.index(anchorRow + len(messages))).top()
+            bar = self.verticalScrollBar()
+            bar.setValue(bar.value() + moved - offset)
+
+    def rowsChanged(self, topLeft, bottomRight, roles=()):
+        self.delegate.sizeHintChanged.emit(topLeft)
+
+    def showContextMenu(self, pos):
+        index = self.indexAt(pos)
+        if not index.isValid():
+            return
+        menu = QMenu(self)
+        copy_action = menu.addAction("Copy message")
+        if menu.exec(self.viewport().mapToGlobal(pos)) == copy_action:
+            QApplication.clipboard().setText(index.data(Qt.DisplayRole))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+async def estimateTokens(texts):
+    """Token counter for backends we can't ask, roughly 4 characters per token for English text."""
+    return [max(1, (len(text) + 3) // 4) for text in texts]
+
+class ContextBuilder():
+    """Picks which turns of a chat go into a prompt, within a token budget.
+
+    The system block is always kept, then turns are packed newest first until the budget is spent.
+    Token counts come from the backend's counter and are cached per turn (and text, so edits get recounted),
+    and turns are only counted as far back as the budget reaches, so a new turn costs one count.
+
+    Once the history is over budget, the oldest kept turn stays put for as long as the window still fits, and when it
+    has to move it moves far enough to free a quarter of the budget. The prompt's prefix then only changes every few
+    replies, so backends reusing the evaluated prefix (the local model's saved state) don't re-evaluate it every time."""
+
+    MESSAGE_OVERHEAD = 4 # Role and separator tokens the chat template adds around every message
+    CHUNK = 32 # Turns counted per call to the counter
+    SLACK = 4 # A moved window leaves budget // SLACK free for the replies to come
+
+    def __init__(self, counter, budget, textOf=lambda turn: turn.get_primary_candidate().text):
+        self.counter = counter # async (list of texts) -> list of token counts
+        self.budget = budget
+        self.textOf = textOf
+        self.counts = {} # (turn_id, text) -> tokens, turn_id is None for system messages
+        self.start = None # turn_id of the oldest turn in the window, None while the whole history fits
+
+    async def count(self, keyed):
+        """Token counts (with message overhead) for (key, text) pairs, only counting the ones not counted before."""
+        missing = list(dict.fromkeys(pair for pair in keyed if pair not in self.counts))
+        if missing:
+            for pair, tokens in zip(missing, await self.counter([text for _, text in missing])):
+                self.counts[pair] = tokens
+        return [self.counts[pair] + self.MESSAGE_OVERHEAD for pair in keyed]
+
+    async def pack(self, turns, room):
+        """How many of the newest turns fit in room tokens."""
+        used = 0
+        kept = 0
+        newest_first = list(reversed(turns))
+        for start in range(0, len(newest_first), self.CHUNK):
+            chunk = newest_first[start:start + self.CHUNK]
+            for tokens in await self.count([(turn.turn_id, self.textOf(turn)) for turn in chunk]):
+                if used + tokens > room:
+                    return kept
+                used += tokens
+                kept += 1
+        return kept
+
+    async def fit(self, system, turns):
+        """system is a list of OpenAI style messages, turns are oldest first.
+        Returns the newest turns that fit in the budget next to the system block, oldest first.
+        Raises ValueError if the system block alone doesn't fit."""
+        used = sum(await self.count([(None, message["content"]) for message in system]))
+        if used > self.budget:
+            raise ValueError(f"The character's prompt alone is {used} tokens, more than the {self.budget} the context has room for.")
+        room = self.budget - used
+        if self.start is not None:
+            index = next((i for i, turn in enumerate(turns) if turn.turn_id == self.start), None)
+            if index is not None:
+                window = turns[index:]
+                if sum(await self.count([(turn.turn_id, self.textOf(turn)) for turn in window])) <= room:
+                    return window
+        kept = await self.pack(turns, room)
+        if kept == len(turns):
+            self.start = None
+            return list(turns)
+        kept = await self.pack(turns, max(0, room - self.budget // self.SLACK))
+        self.start = turns[len(turns) - kept].turn_id if kept else None
+        return turns[len(turns) - kept:] if kept else []
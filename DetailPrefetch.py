@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from PySide6.QtCore import QObject, QEvent, QPoint, QTimer
+
+def detailsAvatarUrl(charinfo):
+    # The big avatar the character details page shows, prefetched and shown with the same URL and size
+    return charinfo.avatar.get_url(size=400, animated=True) if charinfo.avatar else None
+
+DETAILS_AVATAR_SIZE = 300
+
+class DetailPrefetcher():
+    """Speculatively loads what the character details page needs (character info and the big avatar) for the rows the
+    user is likely to open next: hovered or selected ones first, then the ones scrolled into view.
+
+    Wanted characters sit in a small queue, the most recently pointed at first. A character pushed out of it (or
+    scrolled away) is dropped, and its prefetch cancelled if it's running. At most concurrency prefetches run at once."""
+
+    def __init__(self, characters, avatarCache, limit=6, concurrency=2):
+        self.characters = characters
+        self.avatarCache = avatarCache
+        self.limit = limit
+        self.concurrency = concurrency
+        self.pointed = [] # Hovered/selected, newest first
+        self.onScreen = [] # Scrolled into view, top to bottom
+        self.queue = []
+        self.running = {} # character id -> task
+        self.loaded = set() # Prefetched (or tried and failed) already, not fetched again
+
+    def point(self, character_id):
+        if character_id:
+            self.pointed = [character_id] + [other for other in self.pointed if other != character_id][:1]
+            self.update()
+
+    def visible(self, character_ids):
+        self.onScreen = [character_id for character_id in character_ids if character_id]
+        self.update()
+
+    def update(self):
+        self.queue = [character_id for character_id in dict.fromkeys(self.pointed + self.onScreen) if character_id not in self.loaded][:self.limit]
+        for character_id, task in list(self.running.items()):
+            if character_id not in self.queue:
+                task.cancel() # The user moved on
+        for character_id in self.queue:
+            if len(self.running) >= self.concurrency:
+                break
+            if character_id not in self.running:
+                task = asyncio.ensure_future(self.load(character_id))
+                self.running[character_id] = task
+                task.add_done_callback(lambda task, character_id=character_id: self.finished(character_id, task))
+
+    def finished(self, character_id, task):
+        if self.running.get(character_id) is task:
+            del self.running[character_id]
+        if not task.cancelled():
+            task.exception() # Reported in load
+            self.loaded.add(character_id)
+        self.update()
+
+    async def load(self, character_id):
+        try:
+            charinfo = await self.characters.get(character_id)
+            url = detailsAvatarUrl(charinfo)
+            if url:
+                await self.avatarCache.get(url, DETAILS_AVATAR_SIZE)
+        except Exception as e:
+            print(f"Prefetching character {character_id} failed: {e}")
+
+    def watch(self, list_widget, characterOf):
+        """Prefetches for the rows of a QListWidget. characterOf(row) gives a row's character id (or None)."""
+        return ListWatcher(self, list_widget, characterOf)
+
+class ListWatcher(QObject):
+    """Tells a DetailPrefetcher which rows of a list are hovered, selected or scrolled into view. Rows shown when the
+    list fills aren't prefetched (that's the list's own loading time), only the ones the user reaches or points at."""
+
+    def __init__(self, prefetcher, list_widget, characterOf):
+        super().__init__(list_widget)
+        self.prefetcher = prefetcher
+        self.list = list_widget
+        self.characterOf = characterOf
+        self.scrolled = False
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(150) # Scrolling settles before anything is fetched
+        self.timer.timeout.connect(self.scan)
+        list_widget.verticalScrollBar().valueChanged.connect(self.scrolledTo)
+        list_widget.model().rowsInserted.connect(lambda *_: self.timer.start())
+        list_widget.model().modelReset.connect(self.reset)
+        list_widget.currentRowChanged.connect(lambda row: self.prefetcher.point(self.characterAt(row)))
+        self.timer.start() # For rows already in
+
+    def characterAt(self, row):
+        try:
+            return self.characterOf(row) if row >= 0 else None
+        except (IndexError, KeyError):
+            return None
+
+    def reset(self):
+        self.scrolled = False
+        self.prefetcher.visible([])
+
+    def scrolledTo(self, value):
+        self.scrolled = True
+        self.timer.start()
+
+    def visibleRows(self):
+        top = self.list.indexAt(QPoint(1, 1)).row()
+        if top < 0:
+            return range(0)
+        bottom = self.list.indexAt(QPoint(1, self.list.viewport().height() - 2)).row()
+        return range(top, (bottom if bottom >= 0 else self.list.count() - 1) + 1)
+
+    def scan(self):
+        rows = self.visibleRows()
+        for row in rows:
+            # Row widgets cover their items and swallow the mouse moves the list would see, but always get Enter events
+            widget = self.list.itemWidget(self.list.item(row))
+            if widget is not None and not widget.property("prefetchWatched"):
+                widget.setProperty("prefetchWatched", True)
+                widget.installEventFilter(self)
+        if self.scrolled:
+            self.prefetcher.visible([self.characterAt(row) for row in rows])
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Enter:
+            item = self.list.itemAt(watched.geometry().center())
+            if item is not None:
+                self.prefetcher.point(self.characterAt(self.list.row(item)))
+        return False
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage, QPixmap, QPainter, QPainterPath
+
+def render_image(image_data=None, size=100, rounded=False, path=None):
+    """Decodes (from bytes or a file) and scales an image. Rounded images are clipped to a circle.
+    Only uses QImage/QPainter on a QImage, so it is safe to call from any thread."""
+    image = QImage()
+    if path is not None:
+        loaded = image.load(path)
+    else:
+        loaded = image.loadFromData(image_data)
+    if not loaded:
+        return None
+    if path is not None:
+        return image # Files in the disk cache are already scaled
+    if not rounded:
+        return image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    image = image.scaled(size, size, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+    result = QImage(size, size, QImage.Format_ARGB32_Premultiplied)
+    result.fill(Qt.transparent)
+    painter = QPainter(result)
+    painter.setRenderHint(QPainter.Antialiasing)
+    clip = QPainterPath()
+    clip.addEllipse(0, 0, size, size)
+    painter.setClipPath(clip)
+    painter.drawImage(0, 0, image)
+    painter.end()
+    return result
+
+class ImagePipeline():
+    """Worker pool that decodes, scales and masks images off the GUI thread.
+
+    Finished images are queued and handed back to the GUI thread in batches: one event loop callback
+    converts every image that finished since the last one to a QPixmap and resolves their futures."""
+
+    def __init__(self, workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1), thread_name_prefix="ImagePipeline")
+        self.lock = threading.Lock()
+        self.finished = [] # (future, QImage or None) waiting to be delivered
+        self.delivery_scheduled = False
+
+    def process(self, image_data=None, size=100, rounded=False, path=None, save_to=None):
+        """Returns a future resolving (on the event loop thread) to a ready to display QPixmap, or None if the image didn't decode.
+        If save_to is set, the scaled image is also written there as PNG, from the worker."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.executor.submit(self.work, loop, future, image_data, size, rounded, path, save_to)
+        return future
+
+    def work(self, loop, future, image_data, size, rounded, path, save_to):
+        try:
+            image = render_image(image_data, size, rounded, path)
+            if image is not None and save_to is not None:
+                image.save(save_to, "PNG")
+        except Exception as e:
+            print(f"Image pipeline failed to process image: {e}")
+            image = None
+        with self.lock:
+            self.finished.append((future, image))
+            if self.delivery_scheduled:
+                return
+            self.delivery_scheduled = True
+        loop.call_soon_threadsafe(self.deliver)
+
+    def deliver(self):
+        with self.lock:
+            batch, self.finished = self.finished, []
+            self.delivery_scheduled = False
+        for future, image in batch:
+            if not future.done():
+                future.set_result(QPixmap.fromImage(image) if image is not None else None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+class LazyTabs():
+    """Builds the main window's tabs the first time they're shown, instead of all of them at login.
+
+    Every tab is added right away as an empty page (so the tab order never changes), and its builder, an async callable
+    filling the page, runs when the tab is first activated. The tab shown at start gets the network to itself: nothing
+    else is built and no deferred job runs until dataArrived() is called for its page. Then the deferred jobs (like
+    plugins without a tab) run, and if prewarm is on the remaining tabs are built one at a time while the app idles."""
+
+    def __init__(self, tabs, prewarm=True, idleDelay=1000):
+        self.tabs = tabs
+        self.prewarm = prewarm
+        self.idleDelay = idleDelay / 1000
+        self.builders = {} # page -> builder, for tabs not built yet
+        self.building = {} # page -> task running (or done running) its builder
+        self.deferred = [] # Async jobs waiting for the first tab's data
+        self.started = False
+        self.initial = None # Page shown at start, until its data has arrived
+        self.warmer = None
+        tabs.currentChanged.connect(self.activated)
+        tabs.destroyed.connect(self.cancel)
+
+    def add(self, page, label, builder):
+        self.builders[page] = builder
+        return self.tabs.addTab(page, label)
+
+    def later(self, job):
+        """Runs job (async callable) once the first tab has its data, right away if it already has."""
+        if self.started and self.initial is None:
+            asyncio.ensure_future(self.runJob(job))
+        else:
+            self.deferred.append(job)
+
+    def start(self):
+        # Called once every tab is added, builds the one that's showing
+        self.started = True
+        self.initial = self.tabs.currentWidget()
+        if self.build(self.initial) is None:
+            self.dataArrived(self.initial) # Nothing to wait for
+
+    def activated(self, index):
+        if self.started:
+            self.build(self.tabs.widget(index))
+
+    def isBuilt(self, page):
+        return page in self.building
+
+    def build(self, page):
+        builder = self.builders.pop(page, None)
+        if builder is None:
+            return None
+        task = asyncio.ensure_future(self.run(page, builder))
+        self.building[page] = task
+        return task
+
+    async def run(self, page, builder):
+        try:
+            await builder()
+        except Exception as e:
+            print(f"Failed to build tab {self.tabs.tabText(self.tabs.indexOf(page))}: {e}")
+            self.dataArrived(page)
+
+    async def runJob(self, job):
+        try:
+            await job()
+        except Exception as e:
+            print(f"Deferred startup job failed: {e}")
+
+    def dataArrived(self, page):
+        """The page's data has loaded. For the page shown at start, this lets everything else go."""
+        if page is not self.initial:
+            return
+        self.initial = None
+        self.warmer = asyncio.ensure_future(self.warm())
+
+    async def warm(self):
+        deferred, self.deferred = self.deferred, []
+        for job in deferred:
+            await self.runJob(job)
+        if not self.prewarm:
+            return
+        for index in range(self.tabs.count()):
+            await asyncio.sleep(self.idleDelay) # Leave room for whatever the user does meanwhile
+            task = self.build(self.tabs.widget(index))
+            if task is not None:
+                await task
+
+    def cancel(self):
+        if self.warmer is not None:
+            self.warmer.cancel()
+        for task in self.building.values():
+            task.cancel()
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import asyncio
+import hashlib
+import itertools
+import threading
+import importlib.util
+import multiprocessing
+import queue
+from collections import OrderedDict
+
+def available():
+    """True if llama_cpp is installed. Doesn't import it, the GUI process never needs it."""
+    return importlib.util.find_spec("llama_cpp") is not None
+
+def _drainCancels(cancels, cancelled):
+    while True:
+        try:
+            cancelled.add(cancels.get_nowait())
+        except queue.Empty:
+            return
+
+class StateCache():
+    """Saved model states (KV cache and evaluated tokens) in the worker process, so a reply only evaluates what changed.
+
+    Each chat's state is kept under its chat_id in a byte-budgeted LRU, and optionally snapshotted to disk when it's
+    evicted or the worker stops. llama_cpp reuses the longest evaluated token prefix of the loaded state, so after
+    restoring a chat only the new turns get evaluated. Every character also keeps its shortest state (the one closest
+    to just the system block), used for chats that have no state yet, so the long system prompt is evaluated once per character.
+    Chat and character states share the byte budget. Over it, the oldest chat states go first (they can be snapshotted),
+    then the oldest character states."""
+
+    def __init__(self, llama, model_key, budget, snapshot_dir=None, prefixes=8):
+        self.llama = llama
+        self.budget = budget
+        self.snapshot_dir = os.path.join(snapshot_dir, hashlib.sha1(model_key.encode()).hexdigest()) if snapshot_dir else None
+        self.states = OrderedDict() # chat key -> LlamaState
+        self.prefixes = OrderedDict() # character key -> LlamaState
+        self.max_prefixes = prefixes
+        self.current = None # Chat whose state is loaded in the context right now
+        self.current_prefix = None
+
+    @staticmethod
+    def size(state):
+        return state.llama_state_size
+
+    def used(self):
+        # A character's state is often the very same object as one of its chats' states, counted once
+        distinct = {id(state): state for state in list(self.states.values()) + list(self.prefixes.values())}
+        return sum(self.size(state) for state in distinct.values())
+
+    def evict(self):
+        while self.used() > self.budget:
+            if len(self.states) > 1:
+                key, evicted = self.states.popitem(last=False)
+                self.snapshot(key, evicted)
+            elif self.prefixes:
+                self.prefixes.popitem(last=False)
+            else:
+                break # The one state left is bigger than the budget on its own, keep it
+
+    def snapshotPath(self, key):
+        return os.path.join(self.snapshot_dir, hashlib.sha1(key.encode()).hexdigest() + ".state")
+
+    def snapshot(self, key, state):
+        if self.snapshot_dir is None:
+            return
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            path = self.snapshotPath(key)
+            with open(path + ".tmp", "wb") as file:
+                pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            print(f"Failed to snapshot model state: {e}")
+
+    def loadSnapshot(self, key):
+        if self.snapshot_dir is None or not os.path.exists(self.snapshotPath(key)):
+            return None
+        try:
+            with open(self.snapshotPath(key), "rb") as file:
+                return pickle.load(file)
+        except Exception as e:
+            print(f"Failed to read model state snapshot: {e}")
+            return None
+
+    def stash(self):
+        """Saves the state that is in the context under its chat (and as its character's prefix if it's the shortest)."""
+        if self.current is None or self.llama.n_tokens == 0:
+            return
+        state = self.llama.save_state()
+        self.states[self.current] = state
+        self.states.move_to_end(self.current)
+        if self.current_prefix is not None:
+            prefix = self.prefixes.get(self.current_prefix)
+            if prefix is None or prefix.n_tokens > state.n_tokens:
+                self.prefixes[self.current_prefix] = state
+            self.prefixes.move_to_end(self.current_prefix)
+            while len(self.prefixes) > self.max_prefixes:
+                self.prefixes.popitem(last=False)
+        self.evict()
+
+    def activate(self, key, prefix_key):
+        """Makes the context hold the best state for this chat before generating."""
+        if key is not None and key == self.current:
+            self.current_prefix = prefix_key
+            return # Already loaded, the previous reply left it there
+        self.stash()
+        state = self.states.get(key) if key is not None else None
+        if state is None and key is not None:
+            state = self.loadSnapshot(key)
+        if state is None and prefix_key is not None:
+            state = self.prefixes.get(prefix_key)
+        if state is not None:
+            self.llama.load_state(state)
+        else:
+            self.llama.reset()
+        self.current = key
+        self.current_prefix = prefix_key
+
+    def close(self):
+        """Stashes the loaded state and writes every state in memory to disk (if snapshots are on)."""
+        self.stash()
+        for key, state in self.states.items():
+            self.snapshot(key, state)
+
+def workerMain(repo_id, filename, model_options, requests, events, cancels, state_budget, snapshot_dir):
+    """Runs in the worker process: loads the model once, then generates requests one after another.
+    Everything sent back is a (kind, request_id, payload) tuple."""
+    try:
+        from llama_cpp import Llama # type: ignore
+        llama = Llama.from_pretrained(repo_id=repo_id, filename=filename, verbose=True, **model_options)
+    except Exception as e:
+        events.put(("failed", None, str(e)))
+        return
+    states = StateCache(llama, f"{repo_id}/{filename}", state_budget, snapshot_dir)
+    events.put(("ready", None, None))
+    cancelled = set()
+    while True:
+        request = requests.get()
+        if request is None:
+            states.close()
+            break
+        if request[0] == "tokenize":
+            _, request_id, texts = request
+            try:
+                events.put(("counts", request_id, [len(llama.tokenize(text.encode("utf-8"), add_bos=False)) for text in texts]))
+                events.put(("done", request_id, None))
+            except Exception as e:
+                events.put(("error", request_id, str(e)))
+            continue
+        _, request_id, messages, state_key, prefix_key, options = request
+        _drainCancels(cancels, cancelled)
+        if request_id in cancelled:
+            cancelled.discard(request_id)
+            events.put(("done", request_id, None))
+            continue
+        try:
+            states.activate(state_key, prefix_key)
+            for chunk in llama.create_chat_completion(messages=messages, stream=True, **options):
+                _drainCancels(cancels, cancelled)
+                if request_id in cancelled:
+                    break # Dropping the generator stops generation
+                delta = chunk["choices"][0]["delta"]
+                if "content" in delta:
+                    events.put(("token", request_id, delta["content"]))
+            events.put(("done", request_id, None))
+        except Exception as e:
+            states.current = None # Don't keep a state we don't know the shape of
+            events.put(("error", request_id, str(e)))
+        cancelled.discard(request_id)
+
+class LlamaWorker():
+    """A local GGUF model living in its own process, so generating never holds the GIL of the GUI process.
+
+    Requests are queued and generated one at a time. Tokens come back over a multiprocessing queue, which a
+    reader thread forwards to the event loop in batches (one callback for everything that arrived since the last one),
+    where each request has its own asyncio queue. stream() is an async generator of tokens; closing it cancels the request.
+
+    Requests can name a state_key (the chat) and prefix_key (the character) to reuse saved model state, see StateCache."""
+
+    def __init__(self, repo_id, filename="*4_0.gguf", model_options=None, state_budget=1024 * 1024 * 1024, snapshot_dir=None):
+        self.repo_id = repo_id
+        self.filename = filename
+        context = multiprocessing.get_context("spawn") # Forking a process with Qt and a bunch of threads in it isn't safe
+        self.requests = context.Queue()
+        self.events = context.Queue()
+        self.cancels = context.Queue()
+        self.process = context.Process(target=workerMain, args=(repo_id, filename, model_options or {}, self.requests, self.events, self.cancels, state_budget, snapshot_dir),
+                                       name="LlamaWorker", daemon=True)
+        self.snapshot_dir = snapshot_dir
+        self.ids = itertools.count(1)
+        self.streams = {} # request_id -> asyncio.Queue of tokens, None when done
+        self.loop = None
+        self.ready = None
+        self.reader = None
+        self.closed = False
+        self.dead = False # The process died (crash, OOM, killed), nothing will answer anymore
+
+    async def start(self):
+        """Starts the worker and waits until the model is loaded. Raises RuntimeError if it couldn't be loaded."""
+        self.loop = asyncio.get_running_loop()
+        self.ready = self.loop.create_future()
+        self.process.start()
+        self.reader = threading.Thread(target=self.readEvents, name="LlamaWorkerReader", daemon=True)
+        self.reader.start()
+        try:
+            await self.ready
+        except asyncio.CancelledError:
+            # Nobody wants this model anymore, don't let it finish loading
+            self.closed = True
+            self.process.terminate()
+            raise
+        return self
+
+    def readEvents(self):
+        while True:
+            try:
+                batch = [self.events.get(timeout=0.5)]
+            except queue.Empty:
+                if self.closed:
+                    return
+                if not self.process.is_alive():
+                    self.loop.call_soon_threadsafe(self.deliver, [("exited", None, None)])
+                    return
+                continue
+            except (EOFError, OSError):
+                if not self.closed:
+                    self.loop.call_soon_threadsafe(self.deliver, [("exited", None, None)])
+                return
+            try:
+                while len(batch) < 256:
+                    batch.append(self.events.get_nowait())
+            except queue.Empty:
+                pass
+            self.loop.call_soon_threadsafe(self.deliver, batch)
+
+    def deliver(self, batch):
+        for kind, request_id, payload in batch:
+            if kind == "ready":
+                if not self.ready.done():
+                    self.ready.set_result(True)
+            elif kind in ("failed", "exited"):
+                error = RuntimeError(payload or "Local model worker exited")
+                self.dead = True
+                if not self.ready.done():
+                    self.ready.set_exception(error)
+                for stream in self.streams.values():
+                    stream.put_nowait(error)
+                self.streams.clear()
+            elif request_id in self.streams:
+                stream = self.streams[request_id]
+                if kind in ("token", "counts"):
+                    stream.put_nowait(payload)
+                elif kind == "error":
+                    stream.put_nowait(RuntimeError(payload))
+                    del self.streams[request_id]
+                else:
+                    stream.put_nowait(None)
+                    del self.streams[request_id]
+
+    def checkUsable(self):
+        if self.dead:
+            raise RuntimeError("Local model worker exited")
+        if self.closed:
+            raise RuntimeError("Local model worker is closed")
+
+    def submit(self, messages, state_key=None, prefix_key=None, **options):
+        """Queues a chat completion. Returns (request_id, asyncio.Queue receiving tokens, then None, or an exception)."""
+        self.checkUsable()
+        request_id = next(self.ids)
+        stream = asyncio.Queue()
+        self.streams[request_id] = stream
+        self.requests.put(("chat", request_id, messages, state_key, prefix_key, options))
+        return request_id, stream
+
+    def cancel(self, request_id):
+        """Stops a request. Queued requests are skipped, a running one stops at its next token."""
+        if self.streams.pop(request_id, None) is not None:
+            self.cancels.put(request_id)
+
+    async def stream(self, messages, state_key=None, prefix_key=None, **options):
+        request_id, tokens = self.submit(messages, state_key, prefix_key, **options)
+        try:
+            while True:
+                token = await tokens.get()
+                if token is None:
+                    return
+                if isinstance(token, Exception):
+                    raise token
+                yield token
+        finally:
+            self.cancel(request_id)
+
+    async def countTokens(self, texts):
+        """Token counts of texts with the model's own tokenizer. Queued like any other request."""
+        self.checkUsable()
+        request_id = next(self.ids)
+        results = asyncio.Queue()
+        self.streams[request_id] = results
+        self.requests.put(("tokenize", request_id, list(texts)))
+        counts = await results.get()
+        if isinstance(counts, Exception):
+            raise counts
+        return counts
+
+    async def close(self):
+        """Stops the worker process, cancelling everything still queued."""
+        if self.closed:
+            return
+        self.closed = True
+        for request_id in list(self.streams):
+            self.cancel(request_id)
+        if self.process.is_alive():
+            self.requests.put(None)
+            await asyncio.to_thread(self.process.join, 30 if self.snapshot_dir else 5) # Snapshots are written on the way out
+            if self.process.is_alive():
+                self.process.terminate()
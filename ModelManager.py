@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+class ModelManager():
+    """Owns the custom AI backend and the future it is loaded with.
+
+    A backend is described by a key (AIType plus everything it's built from, like repo/filename/params for Local GGUF).
+    load(key) starts loading in the background and returns immediately. Asking for the key that is already loaded
+    (or loading) reuses it, so only settings that change the key cause a reload. A backend whose worker died
+    (dead is set, see LlamaWorker) counts as failed, and is loaded again the next time it's asked for."""
+
+    def __init__(self, factory):
+        self.factory = factory # async key -> backend
+        self.key = None
+        self.future = None # Task resolving to the backend for self.key (None if the key means no backend)
+
+    def failed(self):
+        if not self.future.done():
+            return False
+        if self.future.cancelled() or self.future.exception() is not None:
+            return True
+        return self.isDead()
+
+    def isDead(self):
+        # Loaded fine, but the backend stopped working since
+        return (self.future is not None and self.future.done() and not self.future.cancelled()
+                and self.future.exception() is None and getattr(self.future.result(), "dead", False))
+
+    def load(self, key):
+        if self.future is not None and key == self.key and not self.failed():
+            return self.future
+        previous, self.future = self.future, None
+        self.key = key
+        self.future = asyncio.ensure_future(self.replace(previous, key))
+        self.future.add_done_callback(self.loadDone)
+        return self.future
+
+    async def replace(self, previous, key):
+        if previous is not None:
+            if not previous.done():
+                previous.cancel() # Still loading something nobody wants anymore
+            else:
+                old = None if previous.cancelled() or previous.exception() is not None else previous.result()
+                if old is not None:
+                    await old.close()
+        return await self.factory(key) if key is not None else None
+
+    @staticmethod
+    def loadDone(task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Failed to load custom AI backend: {task.exception()}")
+
+    def current(self):
+        """The loaded backend, or None if there isn't one (yet)."""
+        if self.future is None or not self.future.done() or self.failed():
+            return None
+        return self.future.result()
+
+    async def wait(self):
+        """The backend once it has finished loading, None if there is none or it failed to load."""
+        while self.future is not None:
+            if self.isDead():
+                print("Custom AI backend stopped working, loading it again.")
+                self.load(self.key)
+            future = self.future
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future is self.future:
+                    raise # We were cancelled, not the load
+            except Exception:
+                return None
+        return None
+
+    async def close(self):
+        if self.future is None:
+            return
+        future, self.future = self.future, None
+        self.key = None
+        if not future.done():
+            future.cancel()
+        elif not future.cancelled() and future.exception() is None and future.result() is not None:
+            await future.result().close()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+import re
+import json
+import time
+import datetime
+import threading
+from urllib.parse import urlsplit
+
+AVATARS = "GET avatar" # Every avatar size and file is one endpoint
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000) # Upper bounds, plus one bucket for slower
+
+# Path segments that are ids (numbers, uuids, Character.AI's long base64 ids), so every chat/character is one endpoint
+ID_SEGMENT = re.compile(r"^(\d+|[0-9a-fA-F-]{32,36}|[A-Za-z0-9_-]{20,})$")
+
+def endpointOf(method, url):
+    parts = urlsplit(str(url))
+    if "/static/avatars/" in parts.path:
+        return AVATARS
+    if parts.path.startswith("/api/trpc/"):
+        # Batched calls repeat the procedure once per item
+        return "tRPC " + ",".join(dict.fromkeys(parts.path[len("/api/trpc/"):].split(",")))
+    path = "/".join(":id" if ID_SEGMENT.match(segment) else segment for segment in parts.path.split("/"))
+    return f"{method.upper()} {parts.hostname}{path}"
+
+def formatBytes(count):
+    for unit in ("B", "KB", "MB"):
+        if count < 1024:
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} GB"
+
+class EndpointStats():
+    __slots__ = ("requests", "errors", "statuses", "bytes_in", "bytes_out", "retries", "cache_hits", "histogram", "total", "min", "max")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.statuses = {} # "200", "404" ("OK" for websocket calls), or the exception name if there was no response -> count
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total = 0.0 # Seconds
+        self.min = None
+        self.max = None
+
+    def percentile(self, fraction):
+        """Estimated from the histogram (upper bound of the bucket it falls in), in ms."""
+        wanted = fraction * sum(self.histogram)
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.histogram):
+            seen += count
+            if count and seen >= wanted:
+                return min(bound, self.max * 1000)
+        return self.max * 1000 if self.max is not None else None
+
+    def toDict(self):
+        timed = sum(self.histogram)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "statuses": dict(self.statuses),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "retries": self.retries,
+            "cache_hits": self.cache_hits,
+            "latency_ms": {
+                "mean": self.total * 1000 / timed if timed else None,
+                "min": self.min * 1000 if self.min is not None else None,
+                "max": self.max * 1000 if self.max is not None else None,
+                "p50": self.percentile(0.5),
+                "p95": self.percentile(0.95),
+                "histogram": list(self.histogram),
+            },
+        }
+
+class NetStats():
+    """Per endpoint statistics of every outbound call: latency histogram, bytes each way, status codes, retries and
+    cache hits (requests that didn't have to be made). Shared by the whole app (like the startup profiler) and kept
+    in memory only, the diagnostics menu shows it and exports it as JSON.
+
+    Latency is measured until the response headers for aiohttp and requests, until the whole response for
+    Character.AI's HTTP calls (they're read in one go), and until the first message for its websocket calls.
+    Plugins record from their own threads, so everything is behind a lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {} # endpoint -> EndpointStats
+            self.since = time.time()
+
+    def stats(self, endpoint):
+        # Caller holds the lock
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = EndpointStats()
+        return stats
+
+    def record(self, endpoint, seconds, status=None, error=None, bytes_in=0, bytes_out=0):
+        """One finished request. status is the HTTP status, error the exception if there was no response."""
+        with self.lock:
+            stats = self.stats(endpoint)
+            stats.requests += 1
+            outcome = str(status) if error is None else type(error).__name__
+            stats.statuses[outcome] = stats.statuses.get(outcome, 0) + 1
+            if error is not None or (isinstance(status, int) and status >= 400):
+                stats.errors += 1
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if seconds * 1000 <= bound), len(LATENCY_BUCKETS_MS))
+            stats.histogram[bucket] += 1
+            stats.total += seconds
+            stats.min = seconds if stats.min is None else min(stats.min, seconds)
+            stats.max = seconds if stats.max is None else max(stats.max, seconds)
+
+    def transferred(self, endpoint, bytes_in=0, bytes_out=0):
+        # Bodies streamed after the request was recorded
+        with self.lock:
+            stats = self.stats(endpoint)
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+
+    def retry(self, endpoint):
+        with self.lock:
+            self.stats(endpoint).retries += 1
+
+    def cacheHit(self, endpoint):
+        with self.lock:
+            self.stats(endpoint).cache_hits += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "since": datetime.datetime.fromtimestamp(self.since).isoformat(timespec="seconds"),
+                "taken": datetime.datetime.now().isoformat(timespec="seconds"),
+                "latency_buckets_ms": list(LATENCY_BUCKETS_MS) + [None],
+                "endpoints": {endpoint: stats.toDict() for endpoint, stats in sorted(self.endpoints.items())},
+            }
+
+    def export(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.snapshot(), file, indent=4)
+
+    # Instrumentation
+
+    def aiohttpTrace(self):
+        """TraceConfig recording every request of an aiohttp session."""
+        import aiohttp
+        trace = aiohttp.TraceConfig()
+        async def started(session, context, params):
+            context.endpoint = endpointOf(params.method, params.url)
+            context.began = time.perf_counter()
+        async def sent(session, context, params):
+            self.transferred(context.endpoint, bytes_out=len(params.chunk))
+        async def ended(session, context, params):
+            self.record(context.endpoint, time.perf_counter() - context.began, status=params.response.status)
+        async def received(session, context, params):
+            self.transferred(context.endpoint, bytes_in=len(params.chunk))
+        async def failed(session, context, params):
+            self.record(context.endpoint, time.perf_counter() - context.began, error=params.exception)
+        trace.on_request_start.append(started)
+        trace.on_request_chunk_sent.append(sent)
+        trace.on_request_end.append(ended)
+        trace.on_response_chunk_received.append(received)
+        trace.on_request_exception.append(failed)
+        return trace
+
+    def instrumentRequests(self, session):
+        """Records every request of a requests.Session (redirects count as requests of their own)."""
+        send = session.send
+        def timedSend(request, **kwargs):
+            endpoint = endpointOf(request.method, request.url)
+            sent = len(request.body or b"")
+            began = time.perf_counter()
+            try:
+                response = send(request, **kwargs)
+            except Exception as e:
+                self.record(endpoint, time.perf_counter() - began, error=e, bytes_out=sent)
+                raise
+            received = int(response.headers.get("Content-Length") or 0) if kwargs.get("stream") else len(response.content)
+            self.record(endpoint, response.elapsed.total_seconds(), status=response.status_code, bytes_in=received, bytes_out=sent)
+            return response
+        session.send = timedSend
+
+    def instrumentCharacterAI(self, client):
+        """Records the HTTP requests and websocket calls of a PyCharacterAI client."""
+        requester = client._get_requester()
+        request_async = requester.request_async
+        async def timedRequest(url, options=None):
+            endpoint = endpointOf((options or {}).get("method", "GET"), url)
+            body = (options or {}).get("body") or b""
+            sent = len(body.encode("utf-8") if isinstance(body, str) else body if isinstance(body, bytes) else json.dumps(body))
+            began = time.perf_counter()
+            try:
+                response = await request_async(url, options)
+            except Exception as e:
+                self.record(endpoint, time.perf_counter() - began, error=e, bytes_out=sent)
+                raise
+            self.record(endpoint, time.perf_counter() - began, status=response.status_code, bytes_in=len(response.content or b""), bytes_out=sent)
+            return response
+        requester.request_async = timedRequest
+
+        # The websocket loop resends the same message after a disconnect, a second send of a request is a retry
+        ws_send = requester._Requester__ws_send_async
+        sends = {} # request id -> endpoint, for calls in progress
+        async def countedSend(message, token):
+            request_id = message.get("request_id")
+            if request_id in sends:
+                self.retry(sends[request_id])
+            sends[request_id] = "WS " + str(message.get("command"))
+            return await ws_send(message=message, token=token)
+        requester._Requester__ws_send_async = countedSend
+
+        ws_call = requester.ws_send_and_receive_async
+        async def timedCall(message, token):
+            endpoint = "WS " + str(message.get("command"))
+            sent = len(json.dumps(message))
+            received = 0
+            began = time.perf_counter()
+            first = None
+            error = None
+            try:
+                async for reply in ws_call(message, token):
+                    if first is None:
+                        first = time.perf_counter() - began
+                    received += len(json.dumps(reply))
+                    yield reply
+            except GeneratorExit:
+                raise # The caller had what it wanted
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                sends.pop(message.get("request_id"), None)
+                latency = first if first is not None else time.perf_counter() - began
+                self.record(endpoint, latency, status=None if error else "OK", error=error, bytes_in=received, bytes_out=sent)
+        requester.ws_send_and_receive_async = timedCall
+
+netstats = NetStats()
@@ -11,19 +11,29 @@ from PySide6.QtGui import QIntValidator, QDoubleValidator
 from PySide6.QtCore import QTimer
 from PySide6.QtGui import QTextOption
 import uuid
+import asyncio
 import json
 from threading import Thread
-import requests
 
 class pluginAPI():
-    def __init__(self, qmainwindowapplication,metdata):
+    def __init__(self, qmainwindowapplication,metdata,placeholderTab=None):
         self.QMainWindow = qmainwindowapplication
         self.hasCreatedTab = False
         self.pluginMetadata = metdata
+        self.placeholderTab = placeholderTab # Tab added for the plugin before it ran (plugins with tabName in their metadata)
     
     def CreatePluginTab(self,tabName):
         if not self.hasCreatedTab:
             self.hasCreatedTab = True
+            if self.placeholderTab is not None:
+                # The tab is already there (that's how the plugin got loaded), hand it over
+                widget, layout = self.placeholderTab
+                return {
+                    "tabID": self.QMainWindow.tabs.indexOf(widget),
+                    "widget": widget,
+                    "layout": layout,
+                    "tabName": tabName,
+                }
             # Create a new tab in the main window
             widget = QWidget()
             layout = QVBoxLayout(widget)
@@ -41,17 +51,51 @@ class pluginAPI():
     
     def is_anonymous(self):
         return self.QMainWindow.guestMode
-    
+
+    def getAccount(self):
+        # The logged in account (PyCharacterAI Account) from the app's session, None for guests or until it has loaded.
+        # Never makes a request, call refreshAccount() for that (main thread only).
+        return self.QMainWindow.session.account
+
+    def getUsername(self):
+        return self.QMainWindow.session.username()
+
+    def refreshAccount(self):
+        return self.QMainWindow.session.refresh()
+
+    def get(self, url, **kwargs):
+        # Plain GET over the app's pooled connections. Returns a requests.Response.
+        return self.QMainWindow.transport.blocking.get(url, **kwargs)
+
+    def setAvatar(self, label, url, size, rounded=False, fallbackText="No Image"):
+        # Loads the avatar into a QLabel in the background (decoding and rounding happen off the GUI thread).
+        # Only call this from the main thread (doNotUseThread plugins), since it touches the label.
+        async def load():
+            pixmap = await self.QMainWindow.avatarCache.get(url, size, rounded=rounded)
+            try:
+                if pixmap is not None:
+                    label.setPixmap(pixmap)
+                else:
+                    label.setText(fallbackText)
+            except RuntimeError:
+                pass # Label was deleted before the avatar arrived
+        pixmap = self.QMainWindow.avatarCache.get_cached(url, size, rounded=rounded)
+        if pixmap is not None:
+            label.setPixmap(pixmap)
+            return
+        label.setFixedSize(size, size)
+        asyncio.get_event_loop().create_task(load())
+
     def postWithAuthorization(self, url, data):
-        if self.QMainWindow.authToken is None:
+        if self.QMainWindow.session.token is None:
             raise Exception("Authorization token is not set. Please log in first.")
         headers = {            
             "Content-Type": "application/json",
             "Referer": "https://character.ai/",
             "User-Agent": "Mozilla/5.0 Characterinator/1.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3",
-            "Authorization": f"Token {self.QMainWindow.authToken}"  # Use the auth token from the main window
+            "Authorization": f"Token {self.QMainWindow.session.token}"  # Use the auth token of the current login
         }
-        response = requests.post(url, json=data, headers=headers)
+        response = self.QMainWindow.transport.blocking.post(url, json=data, headers=headers)
         if response.status_code == 200:
             return response.json()
         else:
@@ -62,28 +106,46 @@ class pluginmanager():
         self.plugins = []
         self.QMainWindow = qmainwindowapplication
     
-    def load_plugins(self):
-
+    def load_plugins(self, lazyTabs=None):
+        # With lazyTabs, plugins that name their tab in their metadata ("tabName") get it as a placeholder and only run
+        # once it's opened, the others run after the first tab has loaded. Without it, every plugin runs now.
         plugins_dir = os.path.join(os.path.dirname(__file__), 'plugins')
         for filename in os.listdir(plugins_dir):
             if filename.endswith('.py') and not filename.startswith('_'):
                 plugin_name = filename.split('.')[0]
-                plugin_path = os.path.join(plugins_dir, filename)
-                # Exec the plugin file in a new globals environment
-                plugin_globals = {}
                 with open(os.path.join(plugins_dir,f"{plugin_name}.json"), 'r') as plugin_json_file:
                     metadata = json.load(plugin_json_file)
-                plugin_globals['pluginAPI'] = pluginAPI(self.QMainWindow,metadata)
-                with open(plugin_path, 'r') as plugin_file:
-                    if not metadata.get("doNotUseThread",False):
-                        thread = Thread(target=exec, args=(plugin_file.read(), plugin_globals))
-                        thread.start()
-                    else:
-                        exec(plugin_file.read(), plugin_globals)
-                        thread = None
-                    self.plugins.append({
-                        'name': plugin_name,
-                        'globals': plugin_globals,
-                        'thread': thread
-                    })
-                    print(f"Loaded plugin: {plugin_name} in {'Main Thread' if metadata.get('doNotUseThread',False) else 'Dedicated Thread'}")  
\ No newline at end of file
+                tab_name = metadata.get("tabName")
+                if lazyTabs is None:
+                    self.load_plugin(plugins_dir, plugin_name, metadata)
+                elif tab_name:
+                    widget = QWidget()
+                    layout = QVBoxLayout(widget)
+                    widget.setObjectName("PluginTab_" + str(uuid.uuid4()))
+                    lazyTabs.add(widget, tab_name, self.loader(plugins_dir, plugin_name, metadata, (widget, layout)))
+                else:
+                    lazyTabs.later(self.loader(plugins_dir, plugin_name, metadata))
+
+    def loader(self, plugins_dir, plugin_name, metadata, placeholderTab=None):
+        async def load():
+            self.load_plugin(plugins_dir, plugin_name, metadata, placeholderTab)
+        return load
+
+    def load_plugin(self, plugins_dir, plugin_name, metadata, placeholderTab=None):
+        plugin_path = os.path.join(plugins_dir, f"{plugin_name}.py")
+        # Exec the plugin file in a new globals environment
+        plugin_globals = {}
+        plugin_globals['pluginAPI'] = pluginAPI(self.QMainWindow,metadata,placeholderTab)
+        with open(plugin_path, 'r') as plugin_file:
+            if not metadata.get("doNotUseThread",False):
+                thread = Thread(target=exec, args=(plugin_file.read(), plugin_globals))
+                thread.start()
+            else:
+                exec(plugin_file.read(), plugin_globals)
+                thread = None
+            self.plugins.append({
+                'name': plugin_name,
+                'globals': plugin_globals,
+                'thread': thread
+            })
+            print(f"Loaded plugin: {plugin_name} in {'Main Thread' if metadata.get('doNotUseThread',False) else 'Dedicated Thread'}")  
\ No newline at end of file
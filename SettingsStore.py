@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import os
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree.ElementTree import tostring
+from PySide6.QtCore import QTimer
+
+class SettingsStore():
+    """Write-behind persistence for the settings tree.
+
+    save() only marks the settings dirty and (re)starts a debounce timer, so bursts of changes (typing in the CSS box,
+    logging in) end up as one write. When the timer fires the tree is serialized on the GUI thread (it's tiny, and nothing
+    else may touch it meanwhile), and the bytes are written from a background thread to a temp file that then replaces
+    the real one, so a crash mid-write never leaves a half written settings file. flush() writes right away, and runs at exit."""
+
+    def __init__(self, root, path="config/settings.xml", delay=500):
+        self.root = root
+        self.path = path
+        self.dirty = False
+        self.lock = threading.Lock() # Guards pending, the newest serialized settings not written yet
+        self.pending = None
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SettingsWriter")
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.writeBehind)
+        atexit.register(self.flush) # In case the app goes down without its shutdown running
+
+    def save(self):
+        self.dirty = True
+        self.timer.start()
+
+    def serialize(self):
+        self.dirty = False
+        with self.lock:
+            self.pending = tostring(self.root, encoding="us-ascii", xml_declaration=False)
+
+    def writeBehind(self):
+        if not self.dirty:
+            return
+        self.serialize()
+        self.writer.submit(self.writePending)
+
+    def writePending(self):
+        with self.lock:
+            data, self.pending = self.pending, None
+            if data is None:
+                return # A later write already took it
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            temp = self.path + ".tmp"
+            try:
+                with open(temp, "wb") as file:
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp, self.path)
+            except OSError as e:
+                print(f"Failed to save settings: {e}")
+
+    def flush(self):
+        """Writes any unsaved change now, and waits for writes already queued."""
+        try:
+            self.timer.stop()
+        except RuntimeError:
+            pass # Qt is already gone at exit
+        if self.dirty:
+            self.serialize()
+        self.writePending()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import contextlib
+
+class StartupProfiler():
+    """Where startup time goes. Off unless the app is started with --profile-startup or CHARACTERINATOR_PROFILE_STARTUP=1.
+
+    span() times a phase (imports, settings load, theme apply, authentication), mark() notes when a milestone
+    was first reached (first paint, first data of each tab). Everything is relative to process start and printed
+    as it happens, and report() prints the whole breakdown."""
+
+    def __init__(self):
+        self.enabled = "--profile-startup" in sys.argv or os.environ.get("CHARACTERINATOR_PROFILE_STARTUP", "") not in ("", "0")
+        self.started = time.perf_counter()
+        self.entries = [] # (name, offset from start, duration or None for milestones)
+        self.seen = set()
+        self.reported = False
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @contextlib.contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        begin = self.elapsed()
+        try:
+            yield
+        finally:
+            duration = self.elapsed() - begin
+            self.entries.append((name, begin, duration))
+            print(f"[startup] {name}: {duration * 1000:.0f} ms (at {begin * 1000:.0f} ms)")
+
+    def mark(self, name):
+        """Notes the first time a milestone is reached, later calls with the same name are ignored."""
+        if not self.enabled or name in self.seen:
+            return
+        self.seen.add(name)
+        at = self.elapsed()
+        self.entries.append((name, at, None))
+        print(f"[startup] {name} at {at * 1000:.0f} ms")
+
+    def report(self):
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        print("[startup] Breakdown:")
+        for name, at, duration in sorted(self.entries, key=lambda entry: entry[1]):
+            if duration is None:
+                print(f"[startup]   {at * 1000:8.0f} ms  {name}")
+            else:
+                print(f"[startup]   {at * 1000:8.0f} ms  {name} took {duration * 1000:.0f} ms")
+
+profiler = StartupProfiler()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os
+from defusedxml.ElementTree import parse
+from PySide6.QtCore import QObject, QFileSystemWatcher, Signal
+
+class ThemeRegistry(QObject):
+    """Themes from styles.xml, parsed once. Looking up a theme's QSS is a dictionary lookup.
+
+    The file (and its folder, editors often save by replacing the file) is watched, and edits are parsed again
+    and announced with changed, so the app can re-apply the current theme without a restart."""
+    changed = Signal()
+
+    def __init__(self, path="config/styles.xml", parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.themes = {} # name -> QSS (None for themes without a GlobalStyle, like Default)
+        self.loadedStat = None # (mtime, size) of the file that was parsed
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.fileChanged)
+        self.watcher.directoryChanged.connect(self.fileChanged)
+        self.load()
+        self.watch()
+
+    def stat(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def load(self):
+        themes = {}
+        self.loadedStat = self.stat()
+        try:
+            root = parse(self.path).getroot()
+            print("Found styles.xml!", root)
+            for theme in root.findall(".//Theme"):
+                name = theme.get("name")
+                if name:
+                    style = theme.find("GlobalStyle")
+                    themes[name] = style.text or "" if style is not None else None
+        except Exception as e:
+            print(f"Error loading styles: {str(e)}")
+            return False
+        self.themes = themes
+        return True
+
+    def watch(self):
+        # Watches are dropped when a file is replaced, so they're (re)added every time
+        for path in (self.path, os.path.dirname(self.path) or "."):
+            if os.path.exists(path) and path not in self.watcher.files() + self.watcher.directories():
+                self.watcher.addPath(path)
+
+    def fileChanged(self, path):
+        self.watch()
+        if self.stat() == self.loadedStat:
+            return # Something else in the folder changed (like settings.xml being saved)
+        if self.load():
+            self.changed.emit()
+
+    def names(self):
+        return list(self.themes)
+
+    def styleSheet(self, name):
+        """The theme's QSS, "" if it has none, None if there is no such theme."""
+        if name not in self.themes:
+            return None
+        return self.themes[name] or ""
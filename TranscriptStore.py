@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import uuid
+import sqlite3
+import datetime
+
+class StoredTurn():
+    """A turn read back from the store. Quacks like a PyCharacterAI Turn and its primary candidate at the same time,
+    so getTextFromTurn/convertChatToOpenAIChatHistory work on it unchanged."""
+    __slots__ = ("chat_id", "turn_id", "candidate_id", "author_is_human", "author_name", "text", "create_time")
+
+    def __init__(self, chat_id, turn_id, candidate_id, author_is_human, author_name, text, create_time):
+        self.chat_id = chat_id
+        self.turn_id = turn_id
+        self.candidate_id = candidate_id
+        self.author_is_human = bool(author_is_human)
+        self.author_name = author_name
+        self.text = text
+        self.create_time = create_time
+
+    def get_primary_candidate(self):
+        return self
+
+    def get_candidates(self):
+        return [self]
+
+def turnTimestamp(turn):
+    if isinstance(turn.create_time, datetime.datetime):
+        return turn.create_time.timestamp()
+    return time.time() # Unparsable or missing time, it's new enough for ordering purposes
+
+def primaryCandidate(turn):
+    candidate = turn.get_primary_candidate()
+    if candidate is None:
+        candidate = next(iter(turn.get_candidates()), None)
+    return candidate
+
+class TranscriptStore():
+    """Local SQLite copy of chat transcripts, keyed by chat_id and turn_id (with the candidate shown for each turn).
+
+    For every chat it keeps a contiguous run of turns, from the newest synced turn backwards, plus the API token
+    to continue further back from the oldest one, so history can be served from disk and only the gaps are fetched."""
+
+    LOCAL_PREFIX = "local-" # Turns we added ourselves (sent messages) until a sync brings in the real ones
+
+    def __init__(self, path="cache/transcripts.sqlite3"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS turns (
+                chat_id TEXT NOT NULL,
+                turn_id TEXT NOT NULL,
+                candidate_id TEXT,
+                is_human INTEGER NOT NULL,
+                author_name TEXT,
+                text TEXT NOT NULL,
+                create_time REAL NOT NULL,
+                PRIMARY KEY (chat_id, turn_id)
+            );
+            CREATE INDEX IF NOT EXISTS turns_by_time ON turns (chat_id, create_time, turn_id);
+            CREATE TABLE IF NOT EXISTS chats (
+                chat_id TEXT PRIMARY KEY,
+                older_token TEXT,
+                complete INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        self.db.commit()
+
+    # Reading
+
+    @staticmethod
+    def toTurn(row):
+        return StoredTurn(*row)
+
+    def page(self, chat_id, limit, before=None):
+        """Up to limit turns older than the before turn (or the newest ones), oldest first."""
+        columns = "chat_id, turn_id, candidate_id, is_human, author_name, text, create_time"
+        if before is None:
+            rows = self.db.execute(
+                f"SELECT {columns} FROM turns WHERE chat_id = ? ORDER BY create_time DESC, turn_id DESC LIMIT ?",
+                (chat_id, limit)).fetchall()
+        else:
+            rows = self.db.execute(
+                f"SELECT {columns} FROM turns WHERE chat_id = ? AND (create_time < ? OR (create_time = ? AND turn_id < ?)) "
+                "ORDER BY create_time DESC, turn_id DESC LIMIT ?",
+                (chat_id, before.create_time, before.create_time, before.turn_id, limit)).fetchall()
+        return [self.toTurn(row) for row in reversed(rows)]
+
+    def history(self, chat_id):
+        """Every stored turn of the chat, oldest first."""
+        rows = self.db.execute(
+            "SELECT chat_id, turn_id, candidate_id, is_human, author_name, text, create_time FROM turns "
+            "WHERE chat_id = ? ORDER BY create_time, turn_id", (chat_id,)).fetchall()
+        return [self.toTurn(row) for row in rows]
+
+    def oldest(self, chat_id):
+        row = self.db.execute(
+            "SELECT chat_id, turn_id, candidate_id, is_human, author_name, text, create_time FROM turns "
+            "WHERE chat_id = ? ORDER BY create_time, turn_id LIMIT 1", (chat_id,)).fetchone()
+        return self.toTurn(row) if row else None
+
+    def knows(self, chat_id, turn_id):
+        return self.db.execute("SELECT 1 FROM turns WHERE chat_id = ? AND turn_id = ?", (chat_id, turn_id)).fetchone() is not None
+
+    def chatState(self, chat_id):
+        """(older_token, complete) for the chat."""
+        row = self.db.execute("SELECT older_token, complete FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+        return (row[0], bool(row[1])) if row else (None, False)
+
+    def turnCount(self, chat_id):
+        return self.db.execute("SELECT COUNT(*) FROM turns WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+
+    def isEmpty(self, chat_id):
+        return self.db.execute("SELECT 1 FROM turns WHERE chat_id = ? LIMIT 1", (chat_id,)).fetchone() is None
+
+    # Writing
+
+    def upsertTurns(self, chat_id, turns):
+        """Stores PyCharacterAI turns. Returns how many already stored turns changed text or candidate."""
+        changed = 0
+        for turn in turns:
+            candidate = primaryCandidate(turn)
+            if candidate is None:
+                continue
+            old = self.db.execute("SELECT candidate_id, text FROM turns WHERE chat_id = ? AND turn_id = ?", (chat_id, turn.turn_id)).fetchone()
+            if old is not None and tuple(old) != (candidate.candidate_id, candidate.text):
+                changed += 1
+            self.db.execute(
+                "INSERT OR REPLACE INTO turns (chat_id, turn_id, candidate_id, is_human, author_name, text, create_time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (chat_id, turn.turn_id, candidate.candidate_id, int(turn.author_is_human), turn.author_name, candidate.text, turnTimestamp(turn)))
+        self.db.commit()
+        return changed
+
+    def putTurn(self, chat_id, turn_id, candidate_id, is_human, text, author_name=""):
+        """Stores one turn we know the contents of without asking the API (sent messages, edited replies)."""
+        old = self.db.execute("SELECT create_time FROM turns WHERE chat_id = ? AND turn_id = ?", (chat_id, turn_id)).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO turns (chat_id, turn_id, candidate_id, is_human, author_name, text, create_time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (chat_id, turn_id, candidate_id, int(is_human), author_name, text, old[0] if old else time.time()))
+        self.db.commit()
+
+    def addLocalTurn(self, chat_id, text, is_human=True):
+        turn_id = self.LOCAL_PREFIX + str(uuid.uuid4())
+        self.putTurn(chat_id, turn_id, None, is_human, text)
+        return turn_id
+
+    def removeTurn(self, chat_id, turn_id):
+        self.db.execute("DELETE FROM turns WHERE chat_id = ? AND turn_id = ?", (chat_id, turn_id))
+        self.db.commit()
+
+    def dropLocalTurns(self, chat_id):
+        cursor = self.db.execute("DELETE FROM turns WHERE chat_id = ? AND turn_id LIKE ?", (chat_id, self.LOCAL_PREFIX + "%"))
+        self.db.commit()
+        return cursor.rowcount
+
+    def setChatState(self, chat_id, older_token, complete):
+        self.db.execute("INSERT OR REPLACE INTO chats (chat_id, older_token, complete) VALUES (?, ?, ?)", (chat_id, older_token, int(complete)))
+        self.db.commit()
+
+    # Syncing
+
+    async def sync(self, client, chat_id):
+        """Fetches turns newer than the newest stored one (stops at the first page that reaches a stored turn).
+        On a chat with nothing stored only the newest page is fetched. Returns True if turns that were already
+        stored changed (edits, or our local stand-ins got replaced), meaning anything shown should be reloaded."""
+        empty = self.isEmpty(chat_id)
+        older_token, complete = self.chatState(chat_id)
+        next_token = None
+        rewritten = 0
+        first_page = True
+        while True:
+            turns, next_token = await client.chat.fetch_messages(chat_id, next_token=next_token)
+            if first_page:
+                rewritten += self.dropLocalTurns(chat_id)
+                first_page = False
+            reached_stored = any(self.knows(chat_id, turn.turn_id) for turn in turns)
+            rewritten += self.upsertTurns(chat_id, turns)
+            if not next_token or not turns:
+                self.setChatState(chat_id, None, True) # Walked all the way to the first turn
+                break
+            if empty:
+                self.setChatState(chat_id, next_token, False)
+                break
+            if reached_stored:
+                if older_token is None and not complete:
+                    # Turns were stored without a state (the first sync failed, then we stored a reply), page on from here
+                    self.setChatState(chat_id, next_token, False)
+                break
+        return rewritten > 0
+
+    async def fetchOlder(self, client, chat_id):
+        """Extends the stored run further back, walking past server pages that only hold turns we already have.
+        Returns True if older turns were stored, False if there was nothing older."""
+        before = self.turnCount(chat_id)
+        older_token, complete = self.chatState(chat_id)
+        if older_token is None and not complete:
+            await self.sync(client, chat_id)
+            older_token, complete = self.chatState(chat_id)
+        while not complete and older_token is not None and self.turnCount(chat_id) == before:
+            try:
+                turns, next_token = await client.chat.fetch_messages(chat_id, next_token=older_token)
+            except Exception as e:
+                # Stale token, walk from the newest page until we get past the oldest turn we have
+                print(f"Stored history token didn't work ({e}), walking the history from the start.")
+                oldest = self.oldest(chat_id)
+                next_token = None
+                while True:
+                    turns, next_token = await client.chat.fetch_messages(chat_id, next_token=next_token)
+                    self.upsertTurns(chat_id, turns)
+                    if not next_token or not turns or oldest is None or any(turnTimestamp(turn) < oldest.create_time for turn in turns):
+                        break
+            else:
+                self.upsertTurns(chat_id, turns)
+            older_token, complete = next_token, not next_token or not turns
+            self.setChatState(chat_id, older_token, complete)
+        return self.turnCount(chat_id) > before
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# aiohttp and requests are imported on first use, they're slow to import and most of startup doesn't need them
+from NetStats import netstats
+
+class AppTransport():
+    """The one HTTP transport of the app. Everything (lists, avatars, libanoncai, login, plugins) goes through it,
+    so connections are kept alive and reused instead of paying a TLS handshake per request.
+
+    session() is the pooled aiohttp session for async code.
+    blocking is a pooled requests.Session for code that can't be async (plugins).
+    Both record every request in netstats."""
+
+    def __init__(self, limit=64, limit_per_host=8, dns_cache_ttl=300, keepalive_timeout=60):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+        self._blocking = None
+
+    def session(self):
+        """Returns the shared aiohttp session, creating it on first use. Must be called from the event loop."""
+        if self._session is None or self._session.closed:
+            import aiohttp
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            # No total timeout, streamed replies can take a while. Connecting and stalled reads still time out.
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=120)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[netstats.aiohttpTrace()])
+        return self._session
+
+    @property
+    def blocking(self):
+        if self._blocking is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            self._blocking = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.limit_per_host, pool_maxsize=self.limit_per_host)
+            self._blocking.mount("https://", adapter)
+            self._blocking.mount("http://", adapter)
+            netstats.instrumentRequests(self._blocking)
+        return self._blocking
+
+    def detach(self):
+        """Hands over the current sessions and forgets them, so the next use opens new ones. Pass the result to
+        closeDetached(). Closing detached sessions later can't touch the ones opened meanwhile (a new login's)."""
+        detached = (self._session, self._blocking)
+        self._session = None
+        self._blocking = None
+        return detached
+
+    @staticmethod
+    async def closeDetached(detached):
+        session, blocking = detached
+        if session is not None:
+            await session.close()
+        if blocking is not None:
+            blocking.close()
+
+    async def close(self):
+        """Closes every pooled connection. The transport can still be used afterwards, it just reconnects."""
+        await self.closeDetached(self.detach())
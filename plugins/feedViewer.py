@@ -124,7 +124,7 @@ class FeedViewer(QWidget):
         else:
             self.page += 1
         try:
-            response = requests.get(getFeedURL(page=self.page,topic="puUoF8HHLL8QrsaGaZQ-hXz-pmsSffRxtEDGUZz5iAE",sort="created"))
+            response = pluginAPI.get(getFeedURL(page=self.page,topic="puUoF8HHLL8QrsaGaZQ-hXz-pmsSffRxtEDGUZz5iAE",sort="created"))
             response.raise_for_status()  # Raise an error for bad responses
             data = response.json()
             for post in data.get('posts', []):
@@ -161,7 +161,7 @@ class FeedViewer(QWidget):
         if action == viewDetailsAction:
             try:
                 url = f"https://plus.character.ai/chat/post/?post={post_id}"
-                response = requests.get(url)
+                response = pluginAPI.get(url)
                 response.raise_for_status()
                 print(f"Loaded post details from {url}")
             except requests.RequestException as e:
@@ -260,29 +260,8 @@ class FeedViewer(QWidget):
                 avatar_file = comment.get("src__user__account__avatar_file_name", "")
                 avatar_url = "https://characterai.io/i/80/static/avatars/" + str(avatar_file)
                 avatarLabel = QLabel()
-                try:
-                    avatar_response = requests.get(avatar_url)
-                    avatar_data = avatar_response.content
-                    pixmap = QPixmap()
-                    pixmap.loadFromData(avatar_data)
-
-                    # Round the pixmap (make circular)
-                    size = 40
-                    pixmap = pixmap.scaled(size, size, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
-                    rounded = QPixmap(size, size)
-                    rounded.fill(Qt.transparent)
-
-                    painter = QPainter(rounded)
-                    painter.setRenderHint(QPainter.Antialiasing)
-                    path = QPainterPath()
-                    path.addEllipse(0, 0, size, size)
-                    painter.setClipPath(path)
-                    painter.drawPixmap(0, 0, pixmap)
-                    painter.end()
-
-                    avatarLabel.setPixmap(rounded)
-                except Exception as e:
-                    avatarLabel.setText("No Image")
+                # Rounded (circular) 40px avatar, loaded and rounded in the background by the app's avatar cache
+                pluginAPI.setAvatar(avatarLabel, avatar_url, 40, rounded=True)
 
                 # Create container for text and copy button
                 textContainer = QWidget()